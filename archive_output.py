@@ -0,0 +1,194 @@
+import os
+import io
+import json
+import time
+import tarfile
+import zipfile
+import hashlib
+import threading
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+ARCHIVE_FORMATS = ("zip", "tar.gz", "tar.zst")
+PARTIAL_SUFFIX = ".partial"
+INDEX_NAME = "index.json"
+COPY_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class CourseShard:
+    """ One course's archive, written as files arrive into a
+        PARTIAL_SUFFIX file and renamed into place only once it is
+        complete.
+
+        The index lists every member with its size, sha256 and the
+        offset of its data: in the file for zip, where it is
+        compressed, and in the uncompressed stream for tar. It is stored as the last member
+        and next to the shard as <shard>.index.json.
+    """
+    def __init__(self, path, archive_format):
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.format = archive_format
+        self.names = set()
+        self.index = []
+        self.lock = threading.Lock()
+
+        if archive_format == "zip":
+            self.zip = zipfile.ZipFile(self.partial_path, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self.raw = open(self.partial_path, "wb")
+            if archive_format == "tar.zst":
+                self.stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+                self.tar = tarfile.open(fileobj=self.stream, mode="w|")
+            else:
+                self.stream = None
+                self.tar = tarfile.open(fileobj=self.raw, mode="w|gz")
+
+    def reserve_name(self, name):
+        """ Claim a member name, adding " (n)" before the extension on
+            collisions like the loose file layout does.
+        """
+        root, ext = os.path.splitext(name)
+        n = 0
+        while True:
+            candidate = name if n == 0 else "%s (%d)%s" % (root, n, ext)
+            if candidate not in self.names:
+                self.names.add(candidate)
+                return candidate
+            n += 1
+
+    def add(self, name, f, size, digest):
+        """ Stream size bytes from f into the shard as name, returning
+            the member name it was stored under.
+        """
+        with self.lock:
+            name = self.reserve_name(name)
+            if self.format == "zip":
+                with self.zip.open(name, "w", force_zip64=True) as member:
+                    for chunk in iter(lambda: f.read(COPY_SIZE), b""):
+                        member.write(chunk)
+                info = self.zip.getinfo(name)
+                # The data follows the local header: fixed fields, name and extra field
+                offset = info.header_offset + len(info.FileHeader(zip64=True))
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = int(time.time())
+                self.tar.addfile(info, f)
+                # The stream is now at the end of the member's padded data
+                offset = self.tar.offset - -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self.index.append({"path": name, "size": size, "sha256": digest, "offset": offset})
+            return name
+
+    def add_file(self, name, path, digest=None):
+        if digest is None:
+            digest = file_sha256(path)
+        with open(path, "rb") as f:
+            return self.add(name, f, os.path.getsize(path), digest)
+
+    def add_bytes(self, name, data):
+        return self.add(name, io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+
+    def close(self):
+        """ Write the index and move the finished shard into place.
+        """
+        with self.lock:
+            index = json.dumps(self.index, indent=2).encode()
+            if self.format == "zip":
+                self.zip.writestr(INDEX_NAME, index)
+                self.zip.close()
+            else:
+                info = tarfile.TarInfo(INDEX_NAME)
+                info.size = len(index)
+                info.mtime = int(time.time())
+                self.tar.addfile(info, io.BytesIO(index))
+                self.tar.close()
+                if self.stream is not None:
+                    self.stream.close()
+                self.raw.close()
+            with open(self.partial_path, "rb+") as f:
+                os.fsync(f.fileno())
+
+            index_path = self.path + ".index.json"
+            with open(index_path + PARTIAL_SUFFIX, "wb") as f:
+                f.write(index)
+            os.replace(index_path + PARTIAL_SUFFIX, index_path)
+            os.replace(self.partial_path, self.path)
+
+class ArchiveOutput:
+    """ Save each course into its own archive shard under root
+        instead of as loose files in root/<course>/<section>.
+
+        Callers keep passing the section folder a file would have
+        been saved in; it is mapped to <section>/<name> inside the
+        course's shard. Course names must be unique within a run: a
+        course whose shard was already closed can't be added to.
+    """
+    def __init__(self, root, archive_format, keep_finished=False):
+        if archive_format == "tar.zst" and zstandard is None:
+            raise RuntimeError("pip install zstandard to write tar.zst archives")
+        self.root = root
+        self.format = archive_format
+        self.keep_finished = keep_finished
+        self.shards = {}
+        self.closed = set()
+        self.lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        # Shards left unfinished by an interrupted run can't be appended to
+        for f in os.listdir(root):
+            if f.endswith(PARTIAL_SUFFIX):
+                os.remove(os.path.join(root, f))
+
+    def shard_path(self, course_name):
+        return os.path.join(self.root, "%s.%s" % (course_name, self.format))
+
+    def finished(self, course_name):
+        """ Whether a previous run already completed the shard of
+            course_name and it should be kept.
+        """
+        return self.keep_finished and os.path.exists(self.shard_path(course_name))
+
+    def member(self, folder, name):
+        """ Shard and member name for a file that would have been
+            saved as folder/name.
+        """
+        parts = os.path.relpath(folder, self.root).split(os.sep)
+        with self.lock:
+            if parts[0] in self.closed:
+                raise RuntimeError("The archive of %s was already closed in this run" % parts[0])
+            shard = self.shards.get(parts[0])
+            if shard is None:
+                shard = CourseShard(self.shard_path(parts[0]), self.format)
+                self.shards[parts[0]] = shard
+        return shard, "/".join(parts[1:] + [name])
+
+    def add_file(self, folder, name, path, digest=None):
+        shard, member = self.member(folder, name)
+        return shard.add_file(member, path, digest)
+
+    def add_bytes(self, folder, name, data):
+        shard, member = self.member(folder, name)
+        return shard.add_bytes(member, data)
+
+    def close_course(self, course_name):
+        """ Finish the shard of course_name, writing an empty one if
+            nothing was saved, so a resumed run knows it is done.
+        """
+        with self.lock:
+            if course_name in self.closed:
+                raise RuntimeError("The archive of %s was already closed in this run" % course_name)
+            self.closed.add(course_name)
+            shard = self.shards.pop(course_name, None)
+        if shard is None:
+            shard = CourseShard(self.shard_path(course_name), self.format)
+        shard.close()
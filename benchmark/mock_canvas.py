@@ -0,0 +1,356 @@
+""" Local stand-in for canvas.mit.edu serving synthetic courses
+    as both the HTML pages the crawler scrapes and the REST API.
+
+    python benchmark/mock_canvas.py --courses 3 --port 8000
+"""
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODULE_TYPES = ["wiki_page", "attachment", "assignment", "quiz"]
+API_TYPES = {"wiki_page": "Page", "attachment": "File", "assignment": "Assignment", "quiz": "Quiz"}
+DEFAULT_PER_PAGE = 10
+
+class MockCanvasConfig:
+    """ Shape of the synthetic data and how badly the server behaves.
+    """
+    def __init__(self, courses=3, modules=20, files=30, folder_depth=2, announcements=5, \
+                 assignments=5, file_size=256 * 1024, shared_files=0, latency=0.0, failure_rate=0.0, \
+                 drop_rate=0.0, seed=0):
+        self.courses = courses
+        self.modules = modules
+        self.files = files
+        self.folder_depth = folder_depth
+        self.announcements = announcements
+        self.assignments = assignments
+        self.file_size = file_size
+        self.shared_files = shared_files
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.seed = seed
+
+def file_id(config, course, n):
+    """ Files below shared_files are the same Canvas file in every
+        course, like a class reused across terms.
+    """
+    if n < config.shared_files:
+        return 900000 + n
+    return course * 10000 + n
+
+def file_folder(config, n):
+    """ Folder path a file sits in, spreading files over a chain of
+        nested folders folder_depth deep.
+    """
+    depth = n % (config.folder_depth + 1)
+    return "/".join("folder%d" % level for level in range(1, depth + 1))
+
+def file_body(config, fid, revision=0):
+    block = hashlib.sha256(b"%d-%d" % (fid, revision)).digest()
+    return (block * (config.file_size // len(block) + 1))[:config.file_size]
+
+def page(body):
+    return "<html><head><title>Mock Canvas</title></head><body>%s</body></html>" % body
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def base(self):
+        return "http://%s:%d" % self.server.server_address[:2]
+
+    def send(self, status, body, content_type="text/html", headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_json(self, items, query):
+        """ Send one page of a listing with a rel="next" Link header
+            like the Canvas API.
+        """
+        per_page = int(query.get("per_page", [DEFAULT_PER_PAGE])[0])
+        page_number = int(query.get("page", [1])[0])
+        start = (page_number - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            headers["Link"] = '<%s%s?page=%d&per_page=%d>; rel="next"' % \
+                              (self.base, urlparse(self.path).path, page_number + 1, per_page)
+        self.send(200, json.dumps(items[start:start + per_page]), "application/json", headers)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            self.server.requests += 1
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        url = urlparse(self.path)
+        path, query = url.path.rstrip("/"), parse_qs(url.query)
+
+        if (path.startswith("/api/") or "/download" in path) and \
+           self.server.random.random() < self.config.failure_rate:
+            with self.server.stats_lock:
+                self.server.failures += 1
+            return self.send(503, "Service Unavailable", "text/plain", {"Retry-After": "0"})
+
+        for pattern, handler in self.routes():
+            match = re.fullmatch(pattern, path)
+            if match:
+                return handler(query, *[int(g) if g.isdigit() else g for g in match.groups()])
+        self.send(404, page('<div id="flash_message_holder"><div>Page not available</div></div>'))
+
+    def routes(self):
+        return [
+            (r"/robots\.txt", lambda q: self.send(200, "User-agent: *", "text/plain")),
+            (r"/courses", self.courses_page),
+            (r"/courses/(\d+)/modules", self.modules_page),
+            (r"/courses/(\d+)/pages/page(\d+)", self.wiki_page),
+            (r"/courses/(\d+)/files/(\d+)", self.attachment_page),
+            (r"/courses/(\d+)/assignments/syllabus", self.syllabus_page),
+            (r"/courses/(\d+)/assignments", self.assignments_page),
+            (r"/courses/(\d+)/assignments/(\d+)", self.assignment_page),
+            (r"/courses/(\d+)/quizzes/(\d+)", self.quiz_page),
+            (r"/courses/(\d+)/announcements", self.announcements_page),
+            (r"/courses/(\d+)/discussion_topics/(\d+)", self.announcement_page),
+            (r"/courses/(\d+)/files", lambda q, c: self.folder_page(q, c, "")),
+            (r"/courses/(\d+)/files/folder/(.+)", self.folder_page),
+            (r"/files/(\d+)/download", self.download),
+            (r"/courses/(\d+)/files/(\d+)/download", lambda q, c, f: self.download(q, f)),
+            (r"/api/v1/users/self", lambda q: self.send(200, json.dumps({"id": 1}), "application/json")),
+            (r"/api/v1/courses", self.api_courses),
+            (r"/api/v1/courses/(\d+)/modules", self.api_modules),
+            (r"/api/v1/courses/(\d+)/files", self.api_files),
+            (r"/api/v1/courses/(\d+)/discussion_topics", self.api_announcements),
+            (r"/api/v1/courses/(\d+)/assignments", self.api_assignments),
+        ]
+
+    # Synthetic course contents
+
+    def course_ids(self):
+        return range(1, self.config.courses + 1)
+
+    def module_items(self, course):
+        items = []
+        for n in range(self.config.modules):
+            module_type = MODULE_TYPES[n % len(MODULE_TYPES)]
+            if module_type == "wiki_page":
+                url = "/courses/%d/pages/page%d" % (course, n)
+            elif module_type == "attachment":
+                url = "/courses/%d/files/%d" % (course, file_id(self.config, course, n % max(self.config.files, 1)))
+            elif module_type == "assignment":
+                url = "/courses/%d/assignments/%d" % (course, n)
+            else:
+                url = "/courses/%d/quizzes/%d" % (course, n)
+            items.append((n, module_type, url))
+        return items
+
+    def file_links(self, course, n):
+        """ Files a page links to with file_download_btn.
+        """
+        if not self.config.files:
+            return ""
+        fid = file_id(self.config, course, n % self.config.files)
+        return '<a class="file_download_btn" href="%s/courses/%d/files/%d/download?download_frd=1">file</a>' % \
+               (self.base, course, fid)
+
+    # HTML pages
+
+    def courses_page(self, query):
+        links = "".join('<tr><td><a href="%s/courses/%d">Course %d</a></td></tr>' % (self.base, c, c) \
+                        for c in self.course_ids())
+        self.send(200, page('<table id="my_courses_table">%s</table><table id="past_enrollments_table"></table>' \
+                            % links))
+
+    def modules_page(self, query, course):
+        items = "".join('<li id="context_module_item_%d" class="context_module_item %s"><a href="%s%s">Item %d</a></li>' \
+                        % (n, module_type, self.base, url, n) for n, module_type, url in self.module_items(course))
+        self.send(200, page('<div id="context_modules"><ul>%s</ul></div>' % items))
+
+    def wiki_page(self, query, course, n):
+        self.send(200, page('<div id="wiki_page_show"><h1>Page %d</h1>%s</div>' % (n, self.file_links(course, n))))
+
+    def attachment_page(self, query, course, fid):
+        self.send(200, page('<div id="content"><a href="%s/courses/%d/files/%d/download?download_frd=1">Download file%d</a></div>' \
+                            % (self.base, course, fid, fid)))
+
+    def syllabus_page(self, query, course):
+        self.send(200, page('<div id="course_syllabus"><h1>Syllabus</h1>%s</div>' % self.file_links(course, 0)))
+
+    def assignments_page(self, query, course):
+        rows = "".join('<div class="assignment"><a href="%s/courses/%d/assignments/%d">Assignment %d</a></div>' \
+                       % (self.base, course, 1000 + n, n) for n in range(self.config.assignments))
+        self.send(200, page('<div id="assignment_group_past">%s</div>' % rows))
+
+    def assignment_page(self, query, course, n):
+        self.send(200, page('<div id="content"><div id="assignment_show"><h1>Assignment %d</h1>%s</div></div>' \
+                            % (n, self.file_links(course, n))))
+
+    def quiz_page(self, query, course, n):
+        self.send(200, page('<div id="content"><h1>Quiz %d</h1></div>' % n))
+
+    def announcements_page(self, query, course):
+        rows = "".join('<div class="ic-announcement-row"><a href="%s/courses/%d/discussion_topics/%d">Announcement %d</a></div>' \
+                       % (self.base, course, n, n) for n in range(self.config.announcements))
+        self.send(200, page('<div class="announcements-v2__wrapper">%s</div>' % rows))
+
+    def announcement_page(self, query, course, n):
+        self.send(200, page('<div id="discussion_topic"><h1>Announcement %d</h1></div>' % n))
+
+    def folder_page(self, query, course, folder):
+        links = []
+        depth = len(folder.split("/")) if folder else 0
+        if depth < self.config.folder_depth:
+            child = "%s/folder%d" % (folder, depth + 1) if folder else "folder1"
+            links.append("%s/courses/%d/files/folder/%s" % (self.base, course, child))
+        for n in range(self.config.files):
+            if file_folder(self.config, n) == folder:
+                links.append("%s/courses/%d/files/%d/download?download_frd=1" % \
+                             (self.base, course, file_id(self.config, course, n)))
+        rows = "".join('<a class="ef-name-col__link" href="%s">entry</a>' % link for link in links)
+        self.send(200, page('<div class="ef-directory-header"></div>%s' % rows))
+
+    def download(self, query, fid):
+        # Bumping the server's revision changes every file, like an instructor re-uploading
+        revision = self.server.revision
+        body = file_body(self.config, fid, revision)
+        etag = '"%d-%d-%d"' % (fid, self.config.file_size, revision)
+        headers = {
+            "Content-Disposition": 'attachment; filename="file%d.bin"' % fid,
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+        }
+        status = 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+            if start >= len(body):
+                return self.send(416, "", "text/plain", {"Content-Range": "bytes */%d" % len(body)})
+            end = min(int(match.group(2)), len(body) - 1) if match.group(2) else len(body) - 1
+            headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, len(body))
+            body, status = body[start:end + 1], 206
+
+        if self.command != "HEAD" and self.server.random.random() < self.config.drop_rate:
+            # Promise the whole body, send half and hang up
+            with self.server.stats_lock:
+                self.server.drops += 1
+                self.server.bytes_sent += len(body) // 2
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+
+        if self.command != "HEAD":
+            with self.server.stats_lock:
+                self.server.bytes_sent += len(body)
+        self.send(status, body, "application/octet-stream", headers)
+
+    # REST API
+
+    def api_courses(self, query):
+        self.send_json([{"id": c, "name": "Course %d" % c} for c in self.course_ids()], query)
+
+    def api_modules(self, query, course):
+        items = [{"id": n, "type": API_TYPES[module_type], "html_url": self.base + url} \
+                 for n, module_type, url in self.module_items(course)]
+        for item in items:
+            if item["type"] == "File":
+                item["content_id"] = int(item["html_url"].rsplit("/", 1)[1])
+        self.send_json([{"id": 1, "name": "Module 1", "items": items}], query)
+
+    def api_files(self, query, course):
+        self.send_json([{"id": file_id(self.config, course, n), \
+                         "url": "%s/files/%d/download?download_frd=1" % (self.base, file_id(self.config, course, n)), \
+                         "size": self.config.file_size, "modified_at": "2024-01-%02dT00:00:00Z" % \
+                         (self.server.revision % 28 + 1)} for n in range(self.config.files)], query)
+
+    def api_announcements(self, query, course):
+        self.send_json([{"id": n, "html_url": "%s/courses/%d/discussion_topics/%d" % (self.base, course, n)} \
+                        for n in range(self.config.announcements)], query)
+
+    def api_assignments(self, query, course):
+        self.send_json([{"id": 1000 + n, "html_url": "%s/courses/%d/assignments/%d" % (self.base, course, 1000 + n)} \
+                        for n in range(self.config.assignments)], query)
+
+class MockCanvasServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockCanvasHandler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.drops = 0
+        self.bytes_sent = 0
+        self.revision = 0
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid response are expected, e.g. after a HEAD check
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def add_config_arguments(parser):
+    parser.add_argument("--courses", type=int, default=3)
+    parser.add_argument("--modules", type=int, default=20, help="module items per course")
+    parser.add_argument("--files", type=int, default=30, help="files per course")
+    parser.add_argument("--folder-depth", type=int, default=2)
+    parser.add_argument("--announcements", type=int, default=5)
+    parser.add_argument("--assignments", type=int, default=5)
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="bytes per file")
+    parser.add_argument("--shared-files", type=int, default=0, help="files every course shares")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, \
+                        help="fraction of API and download requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, \
+                        help="fraction of downloads cut off halfway through")
+    parser.add_argument("--seed", type=int, default=0)
+
+def config_from_args(args):
+    return MockCanvasConfig(args.courses, args.modules, args.files, args.folder_depth, args.announcements, \
+                            args.assignments, args.file_size, args.shared_files, args.latency, \
+                            args.failure_rate, args.drop_rate, args.seed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic Canvas instance locally.")
+    parser.add_argument("--port", type=int, default=8000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockCanvasServer(config_from_args(args), port=args.port)
+    print("Mock Canvas at " + server.url)
+    server.serve_forever()
@@ -0,0 +1,150 @@
+""" Time an archive run against a local mock Canvas server.
+
+    python benchmark/run_benchmark.py full --courses 5 --latency 0.05
+    python benchmark/run_benchmark.py files --files 200 --shared-files 50
+
+    "full" runs download_canvas_materials.py --api --headless against
+    the mock and needs Chrome and chromedriver; with --scrape it leaves
+    out --api and discovers work from the mock's pages. "files" skips the
+    browser and only discovers and downloads files through the API,
+    which isolates the HTTP downloader and blob store.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import requests
+
+import pacing
+from metrics import metrics
+from canvas_api import CanvasAPI
+from manifest import Manifest
+from blob_store import BlobStore
+from http_downloader import HttpDownloader, DEFAULT_WORKERS
+from mock_canvas import MockCanvasServer, add_config_arguments, config_from_args
+
+def folder_size(folder):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if not os.path.islink(path):
+                total += os.path.getsize(path)
+    return total
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def run_full(server, workdir, workers, api=True):
+    report_path = os.path.join(workdir, "report.json")
+    command = [sys.executable, os.path.join(REPO, "download_canvas_materials.py"), "--headless", \
+               "--canvas-url", server.url, "--report", report_path, "--workers", str(workers)]
+    if api:
+        command.append("--api")
+    started = time.monotonic()
+    subprocess.run(command, cwd=workdir, check=True)
+    wall = time.monotonic() - started
+    with open(report_path) as f:
+        report = json.load(f)
+    return {
+        "wall_seconds": wall,
+        "slept_seconds": report["slept_seconds"],
+        "items": report["counters"].get("items_done", 0),
+        "bytes": folder_size(os.path.join(workdir, "data", ".blobs")),
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "errors": report["errors"],
+        "phases": report["phases"],
+        "counters": report["counters"],
+    }
+
+def run_files(server, workdir, workers):
+    pacing.HOST_RATES.setdefault("127.0.0.1", pacing.HOST_RATES["canvas.mit.edu"])
+    blob_folder = os.path.join(workdir, "data", ".blobs")
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+    downloader = HttpDownloader(session, BlobStore(blob_folder), \
+                                Manifest(os.path.join(workdir, "manifest.jsonl"), workdir), workers)
+    api = CanvasAPI(session, server.url, listed=downloader.listed)
+
+    started = time.monotonic()
+    items = 0
+    for course_url, course_name in api.courses():
+        folder = os.path.join(workdir, "data", course_name, "other_files")
+        os.makedirs(folder, exist_ok=True)
+        for url in api.files(course_url) or []:
+            downloader.submit(url, folder)
+            items += 1
+    downloader.wait()
+    wall = time.monotonic() - started
+    downloader.shutdown()
+    return {
+        "wall_seconds": wall,
+        "slept_seconds": pacing.slept(),
+        "items": items,
+        "bytes": folder_size(blob_folder),
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "errors": [],
+        "phases": metrics.summary()["phases"],
+        "counters": metrics.summary()["counters"],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark against a local mock Canvas server.")
+    parser.add_argument("mode", choices=["full", "files"])
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--keep", action="store_true", help="keep the working folder to inspect it")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--scrape", action="store_true", \
+                        help="in full mode, discover work by scraping pages instead of through the API")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockCanvasServer(config_from_args(args)).start()
+    workdir = tempfile.mkdtemp(prefix="canvas_benchmark_")
+    try:
+        if args.mode == "full":
+            results = run_full(server, workdir, args.workers, not args.scrape)
+        else:
+            results = run_files(server, workdir, args.workers)
+    finally:
+        server.shutdown()
+        if args.keep:
+            print("Kept " + workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    wall = results["wall_seconds"]
+    results.update({
+        "requests": server.requests,
+        "injected_failures": server.failures,
+        "dropped_downloads": server.drops,
+        "items_per_second": results["items"] / wall if wall else 0,
+        "bytes_per_second": results["bytes"] / wall if wall else 0,
+        # Sleep is summed over every thread, so compare it to the time all workers had
+        "sleep_share": min(1, results["slept_seconds"] / (wall * args.workers)) if wall else 0,
+    })
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("%d items in %.2fs (%.1f items/s)" % (results["items"], wall, results["items_per_second"]))
+        print("%.1f MB stored (%.2f MB/s)" % (results["bytes"] / 2**20, results["bytes_per_second"] / 2**20))
+        print("%.2fs sleeping across threads, %.0f%% of worker time" % \
+              (results["slept_seconds"], 100 * results["sleep_share"]))
+        print("%d requests, %d injected failures, %d dropped downloads" % \
+              (results["requests"], results["injected_failures"], results["dropped_downloads"]))
+        print("Peak RSS %.1f MB" % results["peak_rss_mb"])
+        for phase, totals in sorted(results["phases"].items(), key=lambda p: p[1]["seconds"], reverse=True):
+            print("%-12s %5d spans %8.2fs total %6.2fs max" % \
+                  (phase, totals["count"], totals["seconds"], totals["max_seconds"]))
+        for error in results["errors"]:
+            print("Error: " + error)
@@ -0,0 +1,94 @@
+""" Resuming downloads left behind by an earlier run, against the
+    mock Canvas server.
+
+    python -m pytest benchmark
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+import resumable_download
+from resumable_download import ResumableDownload
+from http_downloader import filename_from_response
+from mock_canvas import MockCanvasConfig, MockCanvasServer, file_body
+
+FILE_ID = 10001
+FILE_SIZE = 64 * 1024
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.config = MockCanvasConfig(courses=1, files=1, file_size=FILE_SIZE)
+        self.server = MockCanvasServer(self.config).start()
+        self.folder = tempfile.mkdtemp(prefix="resume_test_")
+        self.part_path = os.path.join(self.folder, "file.part")
+        self.url = "%s/files/%d/download" % (self.server.url, FILE_ID)
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def leave_part(self, data, **state):
+        """ Leave part_path and its state as an interrupted run would.
+        """
+        with open(self.part_path, "wb") as f:
+            f.write(data)
+        state.setdefault("version", '"%d-%d-%d"' % (FILE_ID, FILE_SIZE, self.server.revision))
+        state.setdefault("size", FILE_SIZE)
+        state.setdefault("name", "file%d.bin" % FILE_ID)
+        state.setdefault("ranges", True)
+        with open(self.part_path + ".json", "w") as f:
+            json.dump(state, f)
+
+    def download(self, segment_executor=None):
+        return ResumableDownload(self.session, self.url, self.part_path, filename_from_response, \
+                                 segment_executor).run()
+
+    def assert_current(self, result):
+        body = file_body(self.config, FILE_ID, self.server.revision)
+        size, version, digest, name = result
+        self.assertEqual(size, len(body))
+        self.assertEqual(digest, hashlib.sha256(body).hexdigest())
+        self.assertFalse(os.path.exists(self.part_path + ".json"))
+
+    def test_complete_part_answered_with_416(self):
+        # The run died after the last byte was written but before it was verified
+        self.leave_part(file_body(self.config, FILE_ID))
+        self.assert_current(self.download())
+
+    def test_overlong_part_answered_with_416_starts_over(self):
+        self.leave_part(file_body(self.config, FILE_ID) + b"extra", size=FILE_SIZE + 5)
+        self.assert_current(self.download())
+
+    def test_file_changed_during_segmented_download_starts_over(self):
+        old = file_body(self.config, FILE_ID)
+        self.leave_part(old[:FILE_SIZE // 2] + bytes(FILE_SIZE // 2), segments=[0])
+        self.server.revision += 1
+
+        segment_size = resumable_download.MIN_SEGMENT_SIZE
+        resumable_download.MIN_SEGMENT_SIZE = FILE_SIZE // 2
+        try:
+            with ThreadPoolExecutor(2) as executor:
+                self.assert_current(self.download(executor))
+        finally:
+            resumable_download.MIN_SEGMENT_SIZE = segment_size
+
+    def test_file_changed_during_stream_starts_over(self):
+        self.leave_part(file_body(self.config, FILE_ID)[:FILE_SIZE // 2])
+        self.server.revision += 1
+        self.assert_current(self.download())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import uuid
+
+class BlobStore:
+    """ Content addressed file store. Each distinct file is kept
+        once under root, named by its sha256, and linked into every
+        folder it belongs in: hardlinked where the filesystem allows
+        it and symlinked otherwise.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.temp_folder = os.path.join(root, "tmp")
+        os.makedirs(self.temp_folder, exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return digest is not None and os.path.exists(self.blob_path(digest))
+
+    def part_path(self, key):
+        """ Where to download the file named by key before it is
+            added to the store. Kept across runs so an interrupted
+            download can be resumed.
+        """
+        return os.path.join(self.temp_folder, "%s.part" % key)
+
+    def add(self, temp_path, digest):
+        """ Move a finished download into the store under its digest,
+            or drop it if the store already holds that content.
+        """
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return path
+
+    def link(self, digest, path):
+        """ Point path at a blob, replacing whatever path held.
+        """
+        blob = self.blob_path(digest)
+        if os.path.exists(path) and os.path.samefile(blob, path):
+            return path
+        temp_path = "%s.%s.link" % (path, uuid.uuid4().hex[:8])
+        try:
+            os.link(blob, temp_path)
+        except OSError:
+            os.symlink(os.path.relpath(blob, os.path.dirname(path)), temp_path)
+        os.replace(temp_path, path)
+        return path
@@ -0,0 +1,145 @@
+import re
+import requests
+
+from pacing import paced_get
+from crawl_filter import CrawlFilter
+
+CANVAS_URL = "https://canvas.mit.edu"
+PER_PAGE = 100
+
+# Canvas API module item types, named as get_module_type names them
+MODULE_ITEM_TYPES = {
+    "ExternalTool": "external_tool",
+    "Assignment": "assignment",
+    "Page": "wiki",
+    "File": "attachment",
+    "ExternalUrl": "external_url",
+    "Quiz": "quiz",
+}
+
+def canvas_file_id(file_url):
+    """ Canvas file id in any file url, e.g. .../files/123/download,
+        .../files/123?verifier=... or .../files/123/preview.
+    """
+    match = re.search(r"/files/(\d+)", file_url)
+    if match:
+        return match.group(1)
+    return file_url[:file_url.rindex("/")].split("/")[-1]
+
+def course_id_from_url(course_url):
+    return course_url.rstrip("/").split("/")[-1]
+
+class CanvasAPI:
+    """ Discover course materials through the Canvas REST API
+        instead of loading and scraping each page.
+
+        Every listing returns the same values the browser discovery
+        does, or None when Canvas refuses access to that section.
+        Courses, files, announcements and assignments the crawl
+        filter excludes by name, term, date or size are left out,
+        and so are module files, found in the course file listing.
+
+        The size and modification time of every file a course lists
+        are put in listed, keyed by file id, before any of its items
+        are returned, so the downloader can skip files it already
+        holds without asking Canvas again.
+    """
+    def __init__(self, session, base_url=CANVAS_URL, crawl_filter=None, listed=None):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.crawl_filter = crawl_filter or CrawlFilter()
+        self.listed = listed if listed is not None else {}
+        # The current course's file listing, shared by its modules and files
+        self.course_files = (None, None)
+
+    def paginate(self, path, params=None):
+        """ Fetch every page of a listing endpoint by following
+            the rel="next" Link header.
+        """
+        url = self.base_url + "/api/v1" + path
+        params = dict(params or {}, per_page=PER_PAGE)
+        results = []
+        while url is not None:
+            response = paced_get(self.session, url, params=params, timeout=30)
+            response.raise_for_status()
+            results.extend(response.json())
+            url = response.links.get("next", {}).get("url")
+            # The next link already carries the query string
+            params = None
+        return results
+
+    def listing(self, path, params=None):
+        try:
+            return self.paginate(path, params)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (401, 403, 404):
+                return None
+            raise
+
+    def courses(self):
+        courses = self.paginate("/courses", {"state[]": ["available", "completed"], "include[]": "term"})
+        return [(self.base_url + "/courses/%d" % course["id"], \
+                 course["name"].replace(" ", "_").replace(".", "_")) \
+                for course in courses if "name" in course and \
+                self.crawl_filter.course(course["name"], (course.get("term") or {}).get("name"))]
+
+    def file_listing(self, course_url):
+        if self.course_files[0] != course_url:
+            files = self.listing("/courses/%s/files" % course_id_from_url(course_url))
+            for f in files or []:
+                modified = f.get("modified_at") or f.get("updated_at")
+                if modified:
+                    self.listed[str(f["id"])] = [f.get("size"), modified]
+            self.course_files = (course_url, files)
+        return self.course_files[1]
+
+    def file_wanted(self, f):
+        return self.crawl_filter.size(f.get("size")) and \
+               self.crawl_filter.modified(f.get("modified_at") or f.get("updated_at"))
+
+    def module_items(self, course_url):
+        # Module files are downloaded first, so list them before the files section does
+        files = {f["id"]: f for f in self.file_listing(course_url) or []}
+        modules = self.listing("/courses/%s/modules" % course_id_from_url(course_url), \
+                               {"include[]": "items"})
+        if modules is None:
+            return None
+        module_url_types = []
+        for module in modules:
+            items = module.get("items")
+            if items is None:
+                # Large modules leave items out and must be fetched separately
+                items = self.paginate("/courses/%s/modules/%d/items" % \
+                                      (course_id_from_url(course_url), module["id"]))
+            for item in items:
+                module_type = MODULE_ITEM_TYPES.get(item["type"])
+                if module_type == "attachment" and item.get("content_id") in files and \
+                   not self.file_wanted(files[item["content_id"]]):
+                    continue
+                if module_type == "external_url" and item.get("external_url"):
+                    # Link straight to the page, saving a load of the Canvas item page
+                    module_url_types.append((item["external_url"], module_type))
+                elif module_type is not None and "html_url" in item:
+                    module_url_types.append((item["html_url"], module_type))
+        return module_url_types
+
+    def announcements(self, course_url):
+        topics = self.listing("/courses/%s/discussion_topics" % course_id_from_url(course_url), \
+                              {"only_announcements": "true"})
+        if topics is None:
+            return None
+        return [topic["html_url"] for topic in topics \
+                if self.crawl_filter.modified(topic.get("last_reply_at") or topic.get("posted_at"))]
+
+    def files(self, course_url):
+        files = self.file_listing(course_url)
+        if files is None:
+            return None
+        return [f["url"] for f in files if f.get("url") and self.file_wanted(f)]
+
+    def assignments(self, course_url):
+        assignments = self.listing("/courses/%s/assignments" % course_id_from_url(course_url))
+        if assignments is None:
+            return None
+        return [assignment["html_url"] for assignment in assignments \
+                if self.crawl_filter.modified(assignment.get("updated_at"))]
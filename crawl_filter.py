@@ -0,0 +1,96 @@
+import re
+import json
+from datetime import datetime, timezone
+
+# Config file keys, named like the command line options
+CONFIG_KEYS = ("include_course", "exclude_course", "term", "sections", "types", "modified_since", "max_file_size")
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def parse_size(value):
+    """ Bytes in a size like 500000, 200K, 1.5G.
+    """
+    if isinstance(value, int):
+        return value
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?)B?\s*", str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError("not a size: %s" % value)
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def parse_time(value):
+    """ Timezone aware datetime from a date like 2024-01-31 or a
+        Canvas timestamp like 2024-01-31T12:00:00Z. Naive values are
+        taken as UTC.
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def split_list(value):
+    if value is None or isinstance(value, list):
+        return value
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+class CrawlFilter:
+    """ Which courses, sections and items to archive. Every check
+        is made while discovering work, so excluded work never costs
+        a page load or a download.
+
+        Anything left unset allows everything. Items whose date or
+        size is not known to the discovery in use are kept.
+    """
+    def __init__(self, include_course=None, exclude_course=None, term=None, sections=None, types=None, \
+                 modified_since=None, max_file_size=None):
+        self.include_course = [re.compile(pattern) for pattern in include_course or []]
+        self.exclude_course = [re.compile(pattern) for pattern in exclude_course or []]
+        self.term = term
+        self.sections = set(split_list(sections)) if sections else None
+        self.types = set(split_list(types)) if types else None
+        self.modified_since = parse_time(modified_since) if modified_since else None
+        self.max_file_size = parse_size(max_file_size) if max_file_size is not None else None
+
+    @classmethod
+    def from_config(cls, path, **overrides):
+        """ Filter from a JSON config file holding any of CONFIG_KEYS,
+            with overrides that are not None taking precedence.
+        """
+        config = {}
+        if path is not None:
+            with open(path) as f:
+                config = json.load(f)
+            unknown = set(config) - set(CONFIG_KEYS)
+            if unknown:
+                raise ValueError("Unknown filter settings in %s: %s" % (path, ", ".join(sorted(unknown))))
+        config.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**config)
+
+    def course(self, name, term=None):
+        """ Whether to archive the course with this display name and
+            term name.
+        """
+        if self.include_course and not any(pattern.search(name) for pattern in self.include_course):
+            return False
+        if any(pattern.search(name) for pattern in self.exclude_course):
+            return False
+        if self.term is not None and (term is None or self.term.lower() not in term.lower()):
+            return False
+        return True
+
+    def section(self, section):
+        return self.sections is None or section in self.sections
+
+    def item_type(self, item_type):
+        return self.types is None or item_type in self.types
+
+    def modified(self, timestamp):
+        """ Whether an item last changed at the Canvas timestamp is
+            recent enough.
+        """
+        if self.modified_since is None or not timestamp:
+            return True
+        return parse_time(timestamp) >= self.modified_since
+
+    def size(self, size):
+        if self.max_file_size is None or size is None:
+            return True
+        return size <= self.max_file_size
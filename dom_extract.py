@@ -0,0 +1,26 @@
+EXTRACT_SCRIPT = """
+var selector = arguments[0], linkSelector = arguments[1];
+return Array.prototype.map.call(document.querySelectorAll(selector), function (el) {
+    var link = linkSelector ? el.querySelector(linkSelector) : el;
+    return {
+        id: el.id,
+        href: link ? link.href || null : null,
+        classes: (el.getAttribute("class") || "").split(/\\s+/).filter(Boolean),
+        text: linkSelector ? (link ? link.innerText : null) : el.innerText
+    };
+});
+"""
+
+def extract(driver, selector, link_selector=None):
+    """ Describe every element matching the CSS selector in one
+        WebDriver call, as a list of {id, href, classes, text}.
+
+        With link_selector, href and text come from the first
+        matching descendant of each element instead, and are None
+        when it has none.
+    """
+    return driver.execute_script(EXTRACT_SCRIPT, selector, link_selector)
+
+def extract_hrefs(driver, selector, link_selector=None):
+    return [record["href"] for record in extract(driver, selector, link_selector) \
+            if record["href"] is not None]
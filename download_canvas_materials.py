@@ -1,20 +1,67 @@
 import os  
+import re
 import sys
+import argparse
 import json
 import time
+import random
 import shutil
+import queue
+from collections import Counter, deque, namedtuple
+from urllib.parse import urlparse
+import threading
 from selenium import webdriver  
 from selenium.webdriver.common.keys import Keys  
 from selenium.webdriver.chrome.options import Options 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from login_with_duo import login_to_canvas, login_to_lms
+from login_with_duo import login_to_canvas, login_to_lms, add_cookies
+from http_downloader import HttpDownloader, session_from_driver
+from canvas_api import CanvasAPI, CANVAS_URL, course_id_from_url
+from manifest import Manifest
+from blob_store import BlobStore
+from journal import Journal
+from download_tracker import DownloadTracker
+import pacing
+from pacing import limiter
+from metrics import metrics, Progress, PROGRESS_INTERVAL
+from pdf_renderer import PdfRenderer
+from archive_output import ArchiveOutput, ARCHIVE_FORMATS
+from dom_extract import extract, extract_hrefs
+from crawl_filter import CrawlFilter
+from external_capture import ExternalCapture, wait_for_network_idle, DEFAULT_WORKERS as DEFAULT_CAPTURE_WORKERS
 from selenium.common.exceptions import TimeoutException
 
 SCRIPT_LOCATION = os.path.abspath('')
 DATA_FOLDER = os.path.join(SCRIPT_LOCATION, 'data/')
-COURSES_URL = "https://canvas.mit.edu/courses"
+MANIFEST_FILE = os.path.join(SCRIPT_LOCATION, 'manifest.jsonl')
+JOURNAL_FILE = os.path.join(SCRIPT_LOCATION, 'journal.jsonl')
+STAGING_FOLDER = os.path.join(DATA_FOLDER, '.staging')
+BLOB_FOLDER = os.path.join(DATA_FOLDER, '.blobs')
+# Kept between runs so Canvas scripts and styles stay cached
+CHROME_CACHE_FOLDER = os.path.join(SCRIPT_LOCATION, '.chrome_cache')
+COURSES_URL = CANVAS_URL + "/courses"
+PAGE_TIMEOUT = 10
+PAGE_ATTEMPTS = 5
+PAGE_DEADLINE = 120
+RETRY_BACKOFF = 1
+
+LOADED = "loaded"
+NOT_AVAILABLE = "not available"
+REDIRECTED = "redirected"
+ITEM_QUEUE_SIZE = 100
+
+# Drivers that print pages render them in full; discovery drivers only read links
+PRINT_PROFILE = "print"
+DISCOVERY_PROFILE = "discovery"
+DISCOVERY_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.webp", "*.ico",
+    "*.mp4", "*.webm", "*.mp3", "*.m4a",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*pendo.io*", "*nr-data.net*", "*newrelic.com*", "*sentry.io*", "*hotjar.com*",
+]
 
 class AnyEC:
     """ Use with WebDriverWait to combine expected_conditions
@@ -32,8 +79,7 @@ class AnyEC:
                 pass
         return False
 
-def get_module_type(module):
-    module_class = module.get_attribute("class").split()
+def get_module_type(module_class):
 
     if "context_external_tool" in module_class:
         return "external_tool"
@@ -48,30 +94,33 @@ def get_module_type(module):
     elif "quiz" in module_class:
         return "quiz"
     
-def wait_for_downloads():
-    not_all_downloaded = True
-    while not_all_downloaded:
-        not_all_downloaded = any(f.endswith("crdownload") for f in os.listdir(DATA_FOLDER))
-        time.sleep(1)
-            
-def load_page_and_wait(driver, page, wait_condition=None, fail_condition=None):
-    driver.get(page)
+def attempt_page_load(driver, page, wait_condition=None, fail_condition=None):
+    """ Load page once and classify the result as LOADED,
+        NOT_AVAILABLE or REDIRECTED (worth another attempt).
+    """
+    wait = WebDriverWait(driver, PAGE_TIMEOUT)
+    metrics.count("page_loads")
+    with metrics.span("load"):
+        limiter.wait(page)
+        driver.get(page)
     if wait_condition is not None:
         condition = wait_condition
         if fail_condition is not None:
             condition = AnyEC(wait_condition, fail_condition)
         try:
-            result = wait.until(condition)
+            with metrics.span("wait"):
+                result = wait.until(condition)
             if fail_condition is not None:
                 if result[0] == 1:
-                    return False
+                    return NOT_AVAILABLE, False
                 else:
-                    return result[1]
+                    return LOADED, result[1]
             else:
-                return result
+                return LOADED, result
         except TimeoutException:
+            metrics.count("wait_timeouts")
             if driver.current_url != page:
-                load_page_and_wait(driver, page, wait_condition, fail_condition)
+                return REDIRECTED, None
             else:
                 raise RuntimeError("Page did not meet expected condition")
     else:
@@ -79,23 +128,119 @@ def load_page_and_wait(driver, page, wait_condition=None, fail_condition=None):
             if driver.current_url != page:
                 try:
                     wait.until(fail_condition)
-                    return False
+                    return NOT_AVAILABLE, False
                 except TimeoutException:
-                    load_page_and_wait(driver, page, wait_condition, fail_condition)
+                    return REDIRECTED, None
             else:
                 raise RuntimeError("Did not navigate to page")
         else:
             if driver.current_url != page:
-                load_page_and_wait(driver, page, wait_condition)
+                return REDIRECTED, None
             else:
                 raise RuntimeError("Did not navigate to page")
 
-        
-if __name__ == "__main__":
-    if os.path.exists(DATA_FOLDER):
-        shutil.rmtree(DATA_FOLDER)
-    os.mkdir(DATA_FOLDER)
-    
+def load_page_and_wait(driver, page, wait_condition=None, fail_condition=None):
+    """ Load page until wait_condition holds, returning its result,
+        or False if fail_condition holds instead. Redirects away
+        from the page are retried with jittered exponential backoff,
+        at most PAGE_ATTEMPTS times and within PAGE_DEADLINE seconds.
+        Canvas is slowed down when fail_condition follows a redirect
+        or holds on REFUSAL_STREAK pages in a row.
+    """
+    deadline = time.monotonic() + PAGE_DEADLINE
+    for attempt in range(PAGE_ATTEMPTS):
+        outcome, result = attempt_page_load(driver, page, wait_condition, fail_condition)
+        if outcome == LOADED:
+            limiter.succeeded(page)
+            return result
+        elif outcome == NOT_AVAILABLE:
+            metrics.count("pages_not_available")
+            # Disabled sections flash too, so one flash alone is not pushback
+            if limiter.refused(page) >= pacing.REFUSAL_STREAK or attempt > 0:
+                limiter.throttled(page)
+            return False
+
+        metrics.count("page_retries")
+
+        delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+        if time.monotonic() + delay > deadline:
+            break
+        pacing.sleep(delay)
+    raise RuntimeError("Page kept redirecting: " + page)
+
+page_not_available = EC.visibility_of_element_located((By.CSS_SELECTOR, "#flash_message_holder > *"))
+
+class BrowserDiscovery:
+    """ Discover course materials by loading each Canvas page in
+        the driver and scraping it. Listings return None when the
+        page is not available. Courses the crawl filter excludes by
+        name or term are left out; pages show no dates or sizes to
+        filter on.
+    """
+    def __init__(self, driver, crawl_filter=None):
+        self.driver = driver
+        self.crawl_filter = crawl_filter or CrawlFilter()
+
+    def courses(self):
+        load_page_and_wait(self.driver, COURSES_URL, EC.visibility_of_element_located((By.ID, "my_courses_table")))
+        rows = "#my_courses_table tr, #past_enrollments_table tr"
+        course_links = extract(self.driver, rows, "a")
+        terms = extract(self.driver, rows, ".course-list-term-column")
+        return [(link["href"], link["text"].replace(" ", "_").replace(".", "_")) \
+                for link, term in zip(course_links, terms) \
+                if link["href"] is not None and self.crawl_filter.course(link["text"], term["text"])]
+
+    def module_items(self, course_url):
+        if not load_page_and_wait(self.driver, course_url + "/modules", \
+                                  EC.visibility_of_element_located((By.ID, "context_modules")), page_not_available):
+            return None
+        modules = extract(self.driver, ".context_module_item", "a")
+        return [(module["href"], get_module_type(module["classes"])) for module in modules \
+                if module["id"] != "context_module_item_blank" and module["href"] is not None]
+
+    def announcements(self, course_url):
+        if not load_page_and_wait(self.driver, course_url + "/announcements", \
+                                  EC.visibility_of_element_located((By.CLASS_NAME, "announcements-v2__wrapper")), \
+                                  page_not_available):
+            return None
+        return extract_hrefs(self.driver, ".ic-announcement-row", "a")
+
+    def files(self, course_url):
+        folder_prefix = course_url + "/files/folder/"
+        file_urls = []
+        folders = deque([course_url + "/files"])
+        seen_folders = set(folders)
+
+        while folders:
+            url = folders.popleft()
+            if not load_page_and_wait(self.driver, url, \
+                                      EC.visibility_of_element_located((By.CLASS_NAME, "ef-directory-header")), \
+                                      page_not_available):
+                continue
+
+            files_and_folder_urls = extract_hrefs(self.driver, ".ef-name-col__link")
+
+            for sub_url in files_and_folder_urls:
+                if sub_url.startswith(folder_prefix):
+                    if sub_url not in seen_folders:
+                        seen_folders.add(sub_url)
+                        folders.append(sub_url)
+                else:
+                    file_urls.append(sub_url)
+
+        return file_urls
+
+    def assignments(self, course_url):
+        if not load_page_and_wait(self.driver, course_url + "/assignments", \
+                                  AnyEC(EC.visibility_of_element_located((By.ID, "assignment_group_upcoming")), \
+                                        EC.visibility_of_element_located((By.ID, "assignment_group_past")), \
+                                        EC.visibility_of_element_located((By.ID, "assignment_group_undated")), \
+                                        EC.visibility_of_element_located((By.ID, "assignment_group_overdue_assignments"))), \
+                                  page_not_available):
+            return None
+        return extract_hrefs(self.driver, ".assignment", "a")
+
+def chrome_options(download_folder, headless=False, profile=PRINT_PROFILE, cache_folder=None):
     print_settings = {
         "recentDestinations": [{
             "id": "Save as PDF",
@@ -106,284 +251,448 @@ if __name__ == "__main__":
         "version": 2
     }
     
-    chrome_options = Options()  
-    chrome_options.add_argument("--ignore-certificate-errors")
-    chrome_options.add_argument("--ignore-urlfetcher-cert-requests")
-    chrome_options.add_argument("--enable-print-browser")
-    chrome_options.add_argument("--kiosk-printing")
-    chrome_options.add_experimental_option("prefs", {
+    options = Options()  
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--ignore-urlfetcher-cert-requests")
+    options.add_argument("--enable-print-browser")
+    options.add_argument("--kiosk-printing")
+    if cache_folder is not None:
+        options.add_argument("--disk-cache-dir=" + cache_folder)
+    if profile == DISCOVERY_PROFILE:
+        # Links are read once the DOM is ready, without waiting for the rest of the page
+        options.page_load_strategy = "eager"
+    options.add_experimental_option("prefs", {
         "plugins.always_open_pdf_externally": True,
-        "download.default_directory" : DATA_FOLDER,
-        "savefile.default_directory": DATA_FOLDER,
+        "download.default_directory" : download_folder,
+        "savefile.default_directory": download_folder,
         "profile.managed_auto_select_certificate_for_urls": ['{"pattern":"https://idp.mit.edu:446","filter":{"ISSUER":{"OU":"Client CA v1"}}}'],
         "printing.print_preview_sticky_settings.appState": json.dumps(print_settings)
         })  
+    return options
 
-    driver = webdriver.Chrome(options=chrome_options) 
-    wait = WebDriverWait(driver, 10)
-    
-    login_to_canvas(driver, COURSES_URL, EC.visibility_of_element_located((By.ID, "my_courses_table")))
-    
-    current_course_table = driver.find_element(by=By.ID, value="my_courses_table")
-    current_course_links = current_course_table.find_elements(by=By.TAG_NAME, value="a")
-    past_course_table = driver.find_element(by=By.ID, value="past_enrollments_table")
-    past_course_links = past_course_table.find_elements(by=By.TAG_NAME, value="a")
-    course_links = current_course_links + past_course_links
-    course_urls_names = [(el.get_attribute("href"), \
-                        el.get_attribute("innerText").replace(" ", "_").replace(".", "_")) \
-                        for el in course_links]
-    
-    page_not_available = EC.visibility_of_element_located((By.CSS_SELECTOR, "#flash_message_holder > *"))
-    
-    for course_url, course_name in course_urls_names:
-        os.mkdir(os.path.join(DATA_FOLDER, course_name))
+def new_driver(download_folder, cookies=None, headless=False, profile=PRINT_PROFILE, cache_folder=None):
+    """ Start a Chrome driver saving into download_folder. When
+        cookies from a logged in driver are given, they are copied
+        in so the new driver skips logging in.
+
+        The discovery profile blocks images, media, fonts and
+        trackers and returns from page loads once the DOM is ready,
+        so it must not be used for printing.
+    """
+    os.makedirs(download_folder, exist_ok=True)
+    driver = webdriver.Chrome(options=chrome_options(download_folder, headless, profile, cache_folder))
+    if profile == DISCOVERY_PROFILE:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": DISCOVERY_BLOCKED_URLS})
+    if cookies is not None:
+        add_cookies(driver, COURSES_URL, cookies)
+    return driver
+
+def save_page_with_files(driver, downloader, tracker, url, folder, wait_condition):
+    """ Load a page, queue every file it links to for download and
+        print it.
+    """
+    wait = WebDriverWait(driver, PAGE_TIMEOUT)
+    load_page_and_wait(driver, url, wait_condition)
+
+    try:
+        driver.find_element(by=By.ID, value="tool_content")
+        wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
+        driver.switch_to.default_content()
+    except:
+        pass
+
+    for file_url in extract_hrefs(driver, ".file_download_btn"):
+        tracker.track(downloader.submit(file_url, folder))
+
+    tracker.print_page(driver, folder)
+
+def save_wiki(driver, downloader, tracker, url, folder):
+    save_page_with_files(driver, downloader, tracker, url, folder, \
+                         EC.visibility_of_element_located((By.ID, "wiki_page_show")))
+
+def save_assignment(driver, downloader, tracker, url, folder):
+    save_page_with_files(driver, downloader, tracker, url, folder, \
+                         EC.visibility_of_element_located((By.ID, "assignment_show")))
+
+def save_content_page(driver, downloader, tracker, url, folder):
+    save_page_with_files(driver, downloader, tracker, url, folder, \
+                         EC.visibility_of_element_located((By.ID, "content")))
+
+def save_attachment(driver, downloader, tracker, url, folder):
+    load_page_and_wait(driver, url, EC.visibility_of_element_located((By.PARTIAL_LINK_TEXT, "Download")))
+
+    download_link = driver.find_element(by=By.PARTIAL_LINK_TEXT, value="Download")
+
+    file_url = download_link.get_attribute("href")
+    tracker.track(downloader.submit(file_url, folder))
+
+def save_external_tool(driver, downloader, tracker, url, folder):
+    tracker.capture_external(url, "external_tool", folder)
+
+def save_external_url(driver, downloader, tracker, url, folder):
+    tracker.capture_external(url, "external_url", folder)
+
+def load_external_tool(driver, url):
+    """ Load an external tool item and wait until the tool inside
+        it stops loading, leaving the driver in the tool's frame.
+    """
+    load_page_and_wait(driver, url, EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
+    wait_for_network_idle(driver)
+
+def resolve_external_url(driver, url):
+    """ Page an external URL item links to. API discovery already
+        gives that page; Canvas item pages are loaded to find it.
+    """
+    if not url.startswith(CANVAS_URL):
+        return url
+    i, external_button = load_page_and_wait(driver, url, \
+                                         AnyEC(EC.visibility_of_element_located((By.ID, "open_url_button")), \
+                                              EC.visibility_of_element_located((By.CSS_SELECTOR, "a.external"))))
+                    
+    external_url = external_button.get_attribute("href")
+
+    if i == 0:
+        driver.switch_to.window(driver.window_handles[1])
+        driver.close()
+        driver.switch_to.window(driver.window_handles[0])
+    return external_url
+
+def load_external_url(driver, external_url):
+    """ Load the page an external URL item links to, logging in to
+        the LMS if needed, and wait until it stops loading.
+    """
+    if external_url.startswith("https://lms.mitx.mit.edu"):
+        login_to_lms(driver, external_url, EC.visibility_of_element_located((By.CLASS_NAME, "learning-header")))
+    else:
+        limiter.wait(external_url)
+        driver.get(external_url)
+    wait_for_network_idle(driver)
+
+# How ExternalCapture resolves and loads each external item type before printing it
+EXTERNAL_CAPTURERS = {
+    "external_tool": (None, load_external_tool),
+    "external_url": (resolve_external_url, load_external_url),
+}
+
+def save_announcement(driver, downloader, tracker, url, folder):
+    load_page_and_wait(driver, url, EC.visibility_of_element_located((By.ID, "discussion_topic")))
+    tracker.print_page(driver, folder)
+
+def save_syllabus(driver, downloader, tracker, url, folder):
+    if load_page_and_wait(driver, url, \
+              EC.visibility_of_element_located((By.ID, "course_syllabus")), \
+              page_not_available):
+
+        for file_url in extract_hrefs(driver, ".file_download_btn"):
+            tracker.track(downloader.submit(file_url, folder))
+
+        tracker.print_page(driver, folder)
+
+def save_file(driver, downloader, tracker, url, folder):
+    tracker.track(downloader.submit(url, folder))
+
+# Work item types, as get_module_type names module items, and how to save each
+ITEM_HANDLERS = {
+    "wiki": save_wiki,
+    "attachment": save_attachment,
+    "assignment": save_assignment,
+    "external_tool": save_external_tool,
+    "external_url": save_external_url,
+    "quiz": save_content_page,
+    "announcement": save_announcement,
+    "syllabus": save_syllabus,
+    "file": save_file,
+    "assignment_page": save_content_page,
+}
+
+SECTIONS = ("modules", "announcements", "syllabus", "other_files", "assignments")
+SECTION_END = "section_end"
+COURSE_END = "course_end"
+
+WorkItem = namedtuple("WorkItem", ["course_url", "course_name", "section", "url", "type"])
+
+def section_items(discovery, course_url, section):
+    """ (url, type) pairs of the work in one section of a course,
+        or None if the section is not available.
+    """
+    if section == "modules":
+        return discovery.module_items(course_url)
+    elif section == "announcements":
+        urls = discovery.announcements(course_url)
+        return None if urls is None else [(url, "announcement") for url in urls]
+    elif section == "syllabus":
+        return [(course_url + "/assignments/syllabus", "syllabus")]
+    elif section == "other_files":
+        urls = discovery.files(course_url)
+        return None if urls is None else [(url, "file") for url in urls]
+    elif section == "assignments":
+        urls = discovery.assignments(course_url)
+        return None if urls is None else [(url, "assignment_page") for url in urls]
+
+def unique_course_names(course_urls_names):
+    """ Give courses that share a display name, like two terms of
+        one class, the Canvas course id as a suffix, so each keeps
+        its own folder and archive.
+    """
+    names = Counter(name for url, name in course_urls_names)
+    return [(url, name if names[name] == 1 else "%s_%s" % (name, course_id_from_url(url))) \
+            for url, name in course_urls_names]
+
+def discover_work(discovery, journal, courses, archive=None):
+    """ Yield work items for the courses taken from the queue,
+        section by section, ending each section with a SECTION_END
+        item and each course with a COURSE_END item. Sections and
+        items already journaled are left out.
+
+        When saving into archives, courses whose archive is finished
+        are left out instead, and the rest are redone in full, since
+        an unfinished archive is thrown away.
+
+        Sections and item types the discovery's crawl filter excludes
+        are never listed or yielded.
+    """
+    crawl_filter = discovery.crawl_filter
+    done = journal.done if archive is None else lambda *args: False
+    while True:
+        try:
+            course_url, course_name = courses.get_nowait()
+        except queue.Empty:
+            return
+        if archive is not None and archive.finished(course_name):
+            continue
+        for section in SECTIONS:
+            if done(course_url, section) or not crawl_filter.section(section):
+                continue
+            with metrics.span("discover", course=course_name, section=section):
+                items = section_items(discovery, course_url, section) or []
+            for url, item_type in items:
+                if crawl_filter.item_type(item_type) and not done(course_url, section, url):
+                    metrics.count("items_discovered")
+                    yield WorkItem(course_url, course_name, section, url, item_type)
+            yield WorkItem(course_url, course_name, section, None, SECTION_END)
+        yield WorkItem(course_url, course_name, None, None, COURSE_END)
+
+def prefetch(iterator, size):
+    """ Run iterator in a background thread, staying at most size
+        items ahead of the consumer.
+    """
+    items = queue.Queue(maxsize=size)
+
+    def produce():
+        try:
+            for item in iterator:
+                items.put((item, None))
+            items.put((StopIteration, None))
+        except Exception as e:
+            items.put((None, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is StopIteration:
+            return
+        yield item
+
+def process_item(driver, downloader, tracker, journal, item):
+    """ Save one work item into its course section folder and
+        journal it once saved. Without a renderer, pages are printed
+        into the worker's staging folder and moved into the section
+        when its SECTION_END item arrives. A course's archive is
+        finished when its COURSE_END item arrives.
+    """
+    if item.type == COURSE_END:
+        if tracker.archive is not None:
+            tracker.finish_course(lambda: tracker.archive.close_course(item.course_name))
+        return
+
+    folder = os.path.join(DATA_FOLDER, item.course_name, item.section)
+    if item.type == SECTION_END:
+        with metrics.span("section_end", course=item.course_name, section=item.section):
+            tracker.finish_section(folder, lambda: journal.record(item.course_url, item.section))
+        return
+
+    handler = ITEM_HANDLERS.get(item.type)
+    if handler is None:
+        raise ValueError("unknown module type")
+    if tracker.archive is None:
+        os.makedirs(folder, exist_ok=True)
+    if item.type != "file":
+        print(item.url)
+    with metrics.span("item", course=item.course_name, section=item.section, item=item.url):
+        handler(driver, downloader, tracker, item.url, folder)
+    tracker.finish_item(lambda: journal.record(item.course_url, item.section, item.url))
+    metrics.count("items_done")
+
+def positive_int(value):
+    """ argparse type for counts that must be at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %s" % value)
+    return number
+
+def run_worker(driver, staging_folder, discovery, downloader, renderer, archive, capture, journal, courses, errors):
+    """ Archive courses taken from the queue until it is empty.
+        Discovery, through the API or its own lean driver, runs
+        ahead in a separate thread while driver saves items.
+    """
+    tracker = DownloadTracker(staging_folder, renderer, archive, capture)
+    work = prefetch(discover_work(discovery, journal, courses, archive), ITEM_QUEUE_SIZE)
+
+    try:
+        for item in work:
+            process_item(driver, downloader, tracker, journal, item)
+        tracker.wait()
+    except Exception as e:
+        errors.append(e)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download all materials from your Canvas courses.")
+    parser.add_argument("--api", action="store_true", \
+                        help="discover courses and materials through the Canvas REST API instead of scraping pages")
+    parser.add_argument("--incremental", action="store_true", \
+                        help="keep previous downloads and only fetch files that are new or changed")
+    parser.add_argument("--workers", type=positive_int, default=1, \
+                        help="number of browsers archiving courses in parallel")
+    parser.add_argument("--headless", action="store_true", \
+                        help="run Chrome headless and save pages with Page.printToPDF, named by item id and title")
+    parser.add_argument("--resume", action="store_true", \
+                        help="continue an interrupted run, skipping everything it already saved")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS, \
+                        help="write each course into one archive in data/ with an index, instead of loose files")
+    parser.add_argument("--filters", metavar="PATH", \
+                        help="JSON file with any of the filter options below, e.g. {\"term\": \"Fall 2023\"}; "
+                             "options given on the command line take precedence")
+    parser.add_argument("--include-course", action="append", metavar="REGEX", \
+                        help="only archive courses whose name matches REGEX (repeatable)")
+    parser.add_argument("--exclude-course", action="append", metavar="REGEX", \
+                        help="skip courses whose name matches REGEX (repeatable)")
+    parser.add_argument("--term", help="only archive courses whose term name contains TERM")
+    parser.add_argument("--sections", help="comma separated sections to archive, from " + ", ".join(SECTIONS))
+    parser.add_argument("--types", \
+                        help="comma separated item types to archive, from " + ", ".join(ITEM_HANDLERS))
+    parser.add_argument("--modified-since", metavar="DATE", \
+                        help="only archive files, announcements and assignments changed since DATE (--api only)")
+    parser.add_argument("--max-file-size", metavar="SIZE", \
+                        help="skip files bigger than SIZE, e.g. 500M")
+    parser.add_argument("--external-workers", type=positive_int, default=DEFAULT_CAPTURE_WORKERS, \
+                        help="number of browsers capturing external tools and URLs alongside the crawl")
+    parser.add_argument("--canvas-url", default=CANVAS_URL, \
+                        help="Canvas instance to archive, e.g. a local mock server for benchmarks")
+    parser.add_argument("--report", metavar="PATH", \
+                        help="write timings per phase and course and counters to PATH as JSON, "
+                             "and every timed span to PATH_spans.csv")
+    parser.add_argument("--progress", action="store_true", \
+                        help="print items done, throughput and an ETA every %d seconds" % PROGRESS_INTERVAL)
+    args = parser.parse_args()
+
+    try:
+        crawl_filter = CrawlFilter.from_config(args.filters, include_course=args.include_course, \
+                                               exclude_course=args.exclude_course, term=args.term, \
+                                               sections=args.sections, types=args.types, \
+                                               modified_since=args.modified_since, \
+                                               max_file_size=args.max_file_size)
+    except (OSError, ValueError, re.error) as e:
+        parser.error(str(e))
+    if crawl_filter.sections is not None and crawl_filter.sections - set(SECTIONS):
+        parser.error("unknown sections: " + ", ".join(sorted(crawl_filter.sections - set(SECTIONS))))
+    if crawl_filter.types is not None and crawl_filter.types - set(ITEM_HANDLERS):
+        parser.error("unknown item types: " + ", ".join(sorted(crawl_filter.types - set(ITEM_HANDLERS))))
+
+    started = time.monotonic()
+    progress = Progress(metrics).start() if args.progress else None
+    CANVAS_URL = args.canvas_url.rstrip("/")
+    COURSES_URL = CANVAS_URL + "/courses"
+    # Another Canvas instance is paced like canvas.mit.edu
+    pacing.HOST_RATES.setdefault(urlparse(CANVAS_URL).hostname, pacing.HOST_RATES["canvas.mit.edu"])
+
+    if not args.resume:
+        if not args.incremental:
+            if os.path.exists(DATA_FOLDER):
+                shutil.rmtree(DATA_FOLDER)
+            if os.path.exists(MANIFEST_FILE):
+                os.remove(MANIFEST_FILE)
+        if os.path.exists(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
+    # Pages printed before an interruption can't be told apart, so start over on them
+    if os.path.exists(STAGING_FOLDER):
+        shutil.rmtree(STAGING_FOLDER)
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    manifest = Manifest(MANIFEST_FILE, DATA_FOLDER)
+    journal = Journal(JOURNAL_FILE)
+    archive = ArchiveOutput(DATA_FOLDER, args.archive, args.resume) if args.archive else None
+
+    staging_folders = [os.path.join(STAGING_FOLDER, "worker%d" % i) for i in range(args.workers)]
+    driver = new_driver(staging_folders[0], headless=args.headless, \
+                        cache_folder=os.path.join(CHROME_CACHE_FOLDER, "%s0" % PRINT_PROFILE))
     
-        # Modules        
-        if load_page_and_wait(driver, course_url + "/modules", \
-                              EC.visibility_of_element_located((By.ID, "context_modules")), page_not_available):
-            modules = driver.find_elements(by=By.CLASS_NAME, value="context_module_item")
-            module_url_types = []
-            for module in modules:
-                if module.get_attribute("id") != "context_module_item_blank":
-                    try:
-                        url = module.find_element(by=By.TAG_NAME, value="a").get_attribute("href")
-                        module_url_types.append((url, get_module_type(module)))
-                    except:
-                        pass
-
-            downloaded_files = set()
-
-            for module_url, module_type in module_url_types:
-                print(module_url)
-                if module_type == "wiki":
-                    load_page_and_wait(driver, module_url, EC.visibility_of_element_located((By.ID, "wiki_page_show")))
-
-                    try:
-                        driver.find_element(by=By.ID, value="tool_content")
-                        wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
-                        driver.switch_to.default_content()
-                    except:
-                        pass
-
-                    file_downloads = driver.find_elements(by=By.CLASS_NAME, value="file_download_btn")
-                    for file_btn in file_downloads:
-                        file_url = file_btn.get_attribute("href")
-                        file_url = file_url[:file_url.rindex("/")].split("/")[-1]
-
-                        if file_url not in downloaded_files:
-                            downloaded_files.add(file_url)
-                            time.sleep(1)
-                            file_btn.click()
-
-                    driver.execute_script('window.print();')
-                elif module_type == "attachment":
-                    load_page_and_wait(driver, module_url, EC.visibility_of_element_located((By.PARTIAL_LINK_TEXT, "Download")))
-
-                    download_link = driver.find_element(by=By.PARTIAL_LINK_TEXT, value="Download")
-
-                    file_url = download_link.get_attribute("href")
-                    file_url = file_url[:file_url.rindex("/")].split("/")[-1]
-
-                    if file_url not in downloaded_files:
-                        downloaded_files.add(file_url)
-                        download_link.click()
-
-                elif module_type == "assignment":
-                    load_page_and_wait(driver, module_url, EC.visibility_of_element_located((By.ID, "assignment_show")))
-
-                    try:
-                        driver.find_element(by=By.ID, value="tool_content")
-                        wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
-                        driver.switch_to.default_content()
-                    except:
-                        pass
-
-                    file_downloads = driver.find_elements(by=By.CLASS_NAME, value="file_download_btn")
-                    for file_btn in file_downloads:
-                        file_url = file_btn.get_attribute("href")
-                        file_url = file_url[:file_url.rindex("/")].split("/")[-1]
-
-                        if file_url not in downloaded_files:
-                            downloaded_files.add(file_url)
-                            time.sleep(1)
-                            file_btn.click()
-
-                    driver.execute_script('window.print();')
-                elif module_type == "external_tool":
-                    load_page_and_wait(driver, module_url, EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
-                    driver.execute_script('window.print();')
-                elif module_type == "external_url":
-                    i, external_button = load_page_and_wait(driver, module_url, \
-                                                         AnyEC(EC.visibility_of_element_located((By.ID, "open_url_button")), \
-                                                              EC.visibility_of_element_located((By.CSS_SELECTOR, "a.external"))))
-                                    
-                    external_url = external_button.get_attribute("href")
-
-                    if i == 0:
-                        driver.switch_to.window(driver.window_handles[1])
-                        driver.close()
-                        driver.switch_to.window(driver.window_handles[0])
-
-                    if external_url.startswith("https://lms.mitx.mit.edu"):
-                        login_to_lms(driver, external_url, EC.visibility_of_element_located((By.CLASS_NAME, "learning-header")))
-                    else:
-                        driver.get(external_url)
-                    time.sleep(3)
-
-                    driver.execute_script('window.print();')
-                elif module_type == "quiz":
-                    load_page_and_wait(driver, module_url, EC.visibility_of_element_located((By.ID, "content")))
-
-                    try:
-                        driver.find_element(by=By.ID, value="tool_content")
-                        wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
-                        driver.switch_to.default_content()
-                    except:
-                        pass
-
-                    file_downloads = driver.find_elements(by=By.CLASS_NAME, value="file_download_btn")
-                    for file_btn in file_downloads:
-                        file_url = file_btn.get_attribute("href")
-                        file_url = file_url[:file_url.rindex("/")].split("/")[-1]
-
-                        if file_url not in downloaded_files:
-                            downloaded_files.add(file_url)
-                            time.sleep(1)
-                            file_btn.click()
-
-                    driver.execute_script('window.print();')
-                else:
-                    raise ValueError("unknown module type")
-                time.sleep(1)
-
-
-            wait_for_downloads()
-
-            os.mkdir(os.path.join(DATA_FOLDER, course_name, "modules"))
-            for f in os.listdir(DATA_FOLDER):
-                if os.path.isfile(os.path.join(DATA_FOLDER, f)):
-                    shutil.move(os.path.join(DATA_FOLDER, f), \
-                                os.path.join(DATA_FOLDER, course_name, "modules", f))
-
-        # Announcements
-        if load_page_and_wait(driver, course_url + "/announcements", \
-                              EC.visibility_of_element_located((By.CLASS_NAME, "announcements-v2__wrapper")), \
-                              page_not_available):
-            announcement_rows = driver.find_elements(by=By.CLASS_NAME, value="ic-announcement-row")
-            announcement_links = [row.find_element(by=By.TAG_NAME, value="a") for row in announcement_rows]
-            announcement_urls = [link.get_attribute("href") for link in announcement_links]
-
-            for announcement_url in announcement_urls:
-                print(announcement_url)
-                load_page_and_wait(driver, announcement_url, EC.visibility_of_element_located((By.ID, "discussion_topic")))
-                driver.execute_script('window.print();')
-                time.sleep(1)
-
-            os.mkdir(os.path.join(DATA_FOLDER, course_name, "announcements"))
-            for f in os.listdir(DATA_FOLDER):
-                if os.path.isfile(os.path.join(DATA_FOLDER, f)):
-                    shutil.move(os.path.join(DATA_FOLDER, f), \
-                                os.path.join(DATA_FOLDER, course_name, "announcements", f))
-
-
-        # Syllabus
-        if load_page_and_wait(driver, course_url + "/assignments/syllabus", \
-                  EC.visibility_of_element_located((By.ID, "course_syllabus")), \
-                  page_not_available):
-
-            file_downloads = driver.find_elements(by=By.CLASS_NAME, value="file_download_btn")
-            for file_btn in file_downloads:
-                file_url = file_btn.get_attribute("href")
-                file_url = file_url[:file_url.rindex("/")]
-
-                if file_url not in downloaded_files:
-                    downloaded_files.add(file_url)
-                    time.sleep(1)
-                    file_btn.click()
-
-            driver.execute_script('window.print();')
-            
-            wait_for_downloads()
-
-            os.mkdir(os.path.join(DATA_FOLDER, course_name, "syllabus"))
-            for f in os.listdir(DATA_FOLDER):
-                if os.path.isfile(os.path.join(DATA_FOLDER, f)):
-                    shutil.move(os.path.join(DATA_FOLDER, f), \
-                                os.path.join(DATA_FOLDER, course_name, "syllabus", f))
-
-        # Files
-        folder_prefix = course_url + "/files/folder/"
-        
-        def collect_files(url):
-            if load_page_and_wait(driver, url, \
-                                  EC.visibility_of_element_located((By.CLASS_NAME, "ef-directory-header")), \
-                                  page_not_available):
+    with metrics.span("login"):
+        login_to_canvas(driver, COURSES_URL, EC.visibility_of_element_located((By.ID, "my_courses_table")))
+    downloader = HttpDownloader(session_from_driver(driver), BlobStore(BLOB_FOLDER), manifest, archive=archive, \
+                                max_size=crawl_filter.max_file_size)
 
-                files_and_folder_links = driver.find_elements(by=By.CLASS_NAME, value="ef-name-col__link")
-                files_and_folder_urls = [link.get_attribute("href") for link in files_and_folder_links]
-
-                folder_urls = []
-                for sub_url in files_and_folder_urls:
-                    if sub_url.startswith(folder_prefix):
-                        folder_urls.append(sub_url)
-                    else:
-                        stripped_url = sub_url[:sub_url.rindex("/")].split("/")[-1]
-                        if stripped_url not in downloaded_files:
-                            driver.get(sub_url)
-                            downloaded_files.add(stripped_url)
-                            time.sleep(1)
-
-                for folder_url in folder_urls:
-                    collect_files(folder_url)
-                
-        collect_files(course_url + "/files")
-        
-        wait_for_downloads()
-            
-        os.mkdir(os.path.join(DATA_FOLDER, course_name, "other_files"))
-        for f in os.listdir(DATA_FOLDER):
-            if os.path.isfile(os.path.join(DATA_FOLDER, f)):
-                shutil.move(os.path.join(DATA_FOLDER, f), \
-                            os.path.join(DATA_FOLDER, course_name, "other_files", f))
-
-        
-        # Assignments
-        if load_page_and_wait(driver, course_url + "/assignments", \
-                              AnyEC(EC.visibility_of_element_located((By.ID, "assignment_group_upcoming")), \
-                                    EC.visibility_of_element_located((By.ID, "assignment_group_past")), \
-                                    EC.visibility_of_element_located((By.ID, "assignment_group_undated")), \
-                                    EC.visibility_of_element_located((By.ID, "assignment_group_overdue_assignments"))), \
-                              page_not_available):
-            assignments = driver.find_elements(by=By.CLASS_NAME, value="assignment")
-            assignment_urls = [assignment.find_element(by=By.TAG_NAME, value="a").get_attribute("href") \
-                               for assignment in assignments]
-
-            for assignment_url in assignment_urls:
-                print(assignment_url)
-                load_page_and_wait(driver, assignment_url, EC.visibility_of_element_located((By.ID, "content")))
-                
-                try:
-                    driver.find_element(by=By.ID, value="tool_content")
-                    wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tool_content")))
-                    driver.switch_to.default_content()
-                except:
-                    pass
-
-                file_downloads = driver.find_elements(by=By.CLASS_NAME, value="file_download_btn")
-                for file_btn in file_downloads:
-                    file_url = file_btn.get_attribute("href")
-                    file_url = file_url[:file_url.rindex("/")]
-
-                    downloaded_files.add(file_url)
-                    time.sleep(1)
-                    file_btn.click()
-
-                driver.execute_script('window.print();')
-                
-        wait_for_downloads()
-            
-        os.mkdir(os.path.join(DATA_FOLDER, course_name, "assignments"))
-        for f in os.listdir(DATA_FOLDER):
-            if os.path.isfile(os.path.join(DATA_FOLDER, f)):
-                shutil.move(os.path.join(DATA_FOLDER, f), \
-                            os.path.join(DATA_FOLDER, course_name, "assignments", f))
+    if args.api:
+        discovery = CanvasAPI(downloader.session, CANVAS_URL, crawl_filter, downloader.listed)
+    else:
+        discovery = BrowserDiscovery(driver, crawl_filter)
+
+    courses = queue.Queue()
+    with metrics.span("courses"):
+        course_urls_names = unique_course_names(discovery.courses())
+    for course_url_name in course_urls_names:
+        courses.put(course_url_name)
+
+    cookies = driver.get_cookies()
+    drivers = [driver] + [new_driver(folder, cookies, args.headless, \
+                                     cache_folder=os.path.join(CHROME_CACHE_FOLDER, "%s%d" % (PRINT_PROFILE, i))) \
+                          for i, folder in enumerate(staging_folders[1:], 1)]
+    if args.api:
+        discoveries = [CanvasAPI(downloader.session, CANVAS_URL, crawl_filter, downloader.listed) \
+                       for i in range(args.workers)]
+        discovery_drivers = []
+    else:
+        # Discovery drivers never print or download, so they always run headless
+        discovery_drivers = [new_driver(folder + "_discovery", cookies, True, DISCOVERY_PROFILE, \
+                                        os.path.join(CHROME_CACHE_FOLDER, "%s%d" % (DISCOVERY_PROFILE, i))) \
+                             for i, folder in enumerate(staging_folders)]
+        discoveries = [BrowserDiscovery(discovery_driver, crawl_filter) for discovery_driver in discovery_drivers]
+    renderer = PdfRenderer(archive=archive) if args.headless else None
+    capture = ExternalCapture(lambda folder, i: new_driver(folder, cookies, args.headless, \
+                                  cache_folder=os.path.join(CHROME_CACHE_FOLDER, "capture%d" % i)), \
+                              EXTERNAL_CAPTURERS, STAGING_FOLDER, renderer, archive, args.external_workers)
+
+    errors = []
+    workers = [threading.Thread(target=run_worker, \
+                                args=(worker_driver, folder, worker_discovery, downloader, renderer, archive, \
+                                      capture, journal, courses, errors)) \
+               for worker_driver, folder, worker_discovery in zip(drivers, staging_folders, discoveries)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    capture.shutdown()
+    for worker_driver in drivers[1:] + discovery_drivers:
+        worker_driver.quit()
+    downloader.shutdown()
+    if renderer is not None:
+        renderer.shutdown()
+    if progress is not None:
+        progress.stop()
+        print(progress.line())
+
+    if args.report:
+        metrics.write_report(args.report, \
+                             courses=len(course_urls_names), \
+                             wall_seconds=time.monotonic() - started, \
+                             slept_seconds=pacing.slept(), \
+                             errors=[repr(e) for e in errors])
+
+    if errors:
+        raise errors[0]
+    shutil.rmtree(STAGING_FOLDER)
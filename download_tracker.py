@@ -0,0 +1,205 @@
+import os
+import time
+import shutil
+import threading
+
+import pacing
+from metrics import metrics
+
+try:
+    from inotify_simple import INotify, flags
+    use_inotify = True
+except ModuleNotFoundError:
+    use_inotify = False
+
+POLL_INTERVAL = 0.1
+PRINT_TIMEOUT = 60
+
+def finished_files(folder):
+    return [f for f in os.listdir(folder) \
+            if os.path.isfile(os.path.join(folder, f)) and not f.endswith(".crdownload")]
+
+def move_downloads(folder, destination):
+    """ Move every file Chrome saved in folder into destination.
+    """
+    os.makedirs(destination, exist_ok=True)
+    for f in os.listdir(folder):
+        if os.path.isfile(os.path.join(folder, f)):
+            shutil.move(os.path.join(folder, f), os.path.join(destination, f))
+
+def archive_downloads(folder, destination, archive):
+    """ Add every file Chrome saved in folder to the archive as if
+        it were saved in destination, removing the originals.
+    """
+    for f in os.listdir(folder):
+        path = os.path.join(folder, f)
+        if os.path.isfile(path):
+            archive.add_file(destination, f, path)
+            os.remove(path)
+
+def when_all_done(futures, callback):
+    """ Call callback once every future has succeeded. It is never
+        called if any of them fails.
+    """
+    if not futures:
+        callback()
+        return
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future):
+        if future.exception() is not None:
+            return
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+def wait_for_files(folder, count, timeout=PRINT_TIMEOUT):
+    """ Block until folder holds at least count finished files.
+        Uses inotify when inotify_simple is installed and polls
+        otherwise. Returns False if the timeout passes first.
+    """
+    deadline = time.monotonic() + timeout
+    inotify = None
+    if use_inotify:
+        inotify = INotify()
+        inotify.add_watch(folder, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO)
+    try:
+        while len(finished_files(folder)) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if inotify is not None:
+                inotify.read(timeout=int(min(remaining, 1) * 1000))
+            else:
+                pacing.sleep(POLL_INTERVAL)
+        return True
+    finally:
+        if inotify is not None:
+            inotify.close()
+
+class DownloadTracker:
+    """ Track the files one worker has started saving: HTTP
+        downloads and printed pages.
+
+        Pages are rendered straight into their section folder when
+        a PdfRenderer is given, and printed by Chrome into the
+        worker's staging folder otherwise. With an ArchiveOutput,
+        printed pages go into the course's archive instead of the
+        section folder. External tools and URLs are handed to an
+        ExternalCapture and tracked like downloads.
+    """
+    def __init__(self, staging_folder, renderer=None, archive=None, capture=None):
+        self.staging_folder = staging_folder
+        self.renderer = renderer
+        self.archive = archive
+        self.capture = capture
+        self.outstanding = set()
+        self.failures = []
+        self.printed = 0
+        self.item_futures = []
+        self.item_printed = False
+        self.section_futures = []
+        self.course_futures = []
+        self.after_section = []
+        self.lock = threading.Lock()
+
+    def started(self, future):
+        with self.lock:
+            self.outstanding.add(future)
+        self.item_futures.append(future)
+        self.section_futures.append(future)
+        if self.archive is not None:
+            # Only archives wait for the whole course, so loose runs keep no course list
+            self.course_futures.append(future)
+        future.add_done_callback(self.settled)
+
+    def settled(self, future):
+        with self.lock:
+            self.outstanding.discard(future)
+            if future.exception() is not None:
+                self.failures.append(future.exception())
+
+    def track(self, future):
+        self.started(future)
+
+    def print_page(self, driver, folder):
+        metrics.count("pages_printed")
+        with metrics.span("print"):
+            if self.renderer is not None:
+                self.started(self.renderer.submit(driver, folder))
+            else:
+                driver.execute_script('window.print();')
+                self.printed += 1
+                self.item_printed = True
+
+    def capture_external(self, url, item_type, folder):
+        self.started(self.capture.submit(url, item_type, folder))
+
+    def finish_item(self, callback):
+        """ Call callback once everything started since the last
+            finished item has been saved in place.
+        """
+        futures, self.item_futures = self.item_futures, []
+        if self.item_printed:
+            # Pages Chrome printed are only in place once their section is moved
+            self.item_printed = False
+            self.after_section.append((futures, callback))
+        else:
+            when_all_done(futures, callback)
+
+    def finish_section(self, destination, callback):
+        """ Move the pages Chrome printed for this section into
+            destination, and call callback once everything started
+            in the section has been saved. Downloads still running
+            are not waited for.
+
+            If Chrome did not write every page in time, neither
+            callback nor those of the section's printed items are
+            called, so a resumed run saves them again.
+        """
+        complete = True
+        if self.printed:
+            with metrics.span("print_wait"):
+                if not wait_for_files(self.staging_folder, self.printed):
+                    complete = False
+                    metrics.count("print_timeouts")
+                    print("Timed out waiting for %d printed pages in %s" % (self.printed, self.staging_folder))
+            self.printed = 0
+            with metrics.span("move"):
+                if self.archive is not None:
+                    archive_downloads(self.staging_folder, destination, self.archive)
+                else:
+                    move_downloads(self.staging_folder, destination)
+
+        after_section, self.after_section = self.after_section, []
+        futures, self.section_futures = self.section_futures, []
+        if not complete:
+            # Which pages are missing can't be told, so none of them count as saved
+            return
+        for item_futures, item_callback in after_section:
+            when_all_done(item_futures, item_callback)
+        when_all_done(futures, callback)
+
+    def finish_course(self, callback):
+        """ Call callback once everything started in the course has
+            been saved. Its sections must all be finished first.
+        """
+        futures, self.course_futures = self.course_futures, []
+        when_all_done(futures, callback)
+
+    def wait(self):
+        """ Block until every download and render started so far
+            has finished, raising the first failure.
+        """
+        with self.lock:
+            outstanding = list(self.outstanding)
+        for future in outstanding:
+            future.result()
+        if self.failures:
+            raise self.failures[0]
@@ -0,0 +1,189 @@
+import os
+import time
+import queue
+import shutil
+import threading
+from concurrent.futures import Future
+
+import pacing
+from metrics import metrics
+from download_tracker import wait_for_files, finished_files
+from pdf_renderer import write_pdf
+
+DEFAULT_WORKERS = 2
+IDLE_WINDOW = 0.5
+IDLE_TIMEOUT = 20
+IDLE_POLL = 0.1
+
+# Resource count and load state of the current document
+NETWORK_STATE_SCRIPT = """
+return [document.readyState, performance.getEntriesByType("resource").length];
+"""
+
+def wait_for_network_idle(driver, idle=IDLE_WINDOW, timeout=IDLE_TIMEOUT):
+    """ Block until the current document has finished loading and
+        fetched no new resources for idle seconds, or timeout passes.
+        Returns whether the page went idle.
+    """
+    deadline = time.monotonic() + timeout
+    last_count, last_change = None, time.monotonic()
+    while time.monotonic() < deadline:
+        state, count = driver.execute_script(NETWORK_STATE_SCRIPT)
+        if count != last_count or state != "complete":
+            last_count, last_change = count, time.monotonic()
+        elif time.monotonic() - last_change >= idle:
+            return True
+        pacing.sleep(IDLE_POLL)
+    metrics.count("network_idle_timeouts")
+    return False
+
+def place_copy(path, folder):
+    """ Put a copy of path in folder under the same name, adding
+        " (n)" before the extension if the name is taken.
+    """
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.basename(path)
+    root, ext = os.path.splitext(name)
+    n = 0
+    while True:
+        destination = os.path.join(folder, name if n == 0 else "%s (%d)%s" % (root, n, ext))
+        if not os.path.exists(destination):
+            break
+        n += 1
+    try:
+        os.link(path, destination)
+    except OSError:
+        shutil.copy2(path, destination)
+    return destination
+
+def chain(source, future):
+    """ Resolve future the same way as the finished source future.
+    """
+    if source.exception() is not None:
+        future.set_exception(source.exception())
+    else:
+        future.set_result(source.result())
+
+class ExternalCapture:
+    """ Capture external tools and external URLs off the main crawl.
+
+        Targets are queued and captured by up to workers threads,
+        each with its own driver, started the first time a target
+        arrives. Each target is captured once per run however many
+        courses link it; every folder it was submitted for gets a
+        copy.
+
+        capturers maps an item type to a pair of functions taking a
+        driver and a URL: resolve, which returns the URL of the page
+        the item really shows (or is None if that is the item URL),
+        and load, which loads that page and waits until it is ready
+        to print. Items resolving to the same page share a capture.
+
+        Pages are printed with renderer when given, and by Chrome
+        into a per-driver staging folder otherwise.
+    """
+    def __init__(self, new_driver, capturers, staging_folder, renderer=None, archive=None, \
+                 workers=DEFAULT_WORKERS):
+        self.new_driver = new_driver
+        self.capturers = capturers
+        self.staging_folder = staging_folder
+        self.renderer = renderer
+        self.archive = archive
+        self.workers = workers
+        self.targets = queue.Queue()
+        self.captures = {}
+        self.resolved = {}
+        self.threads = []
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def submit(self, url, item_type, folder):
+        """ Queue url for capture unless it already was, and return
+            a future that resolves to where it was saved in folder.
+        """
+        with self.lock:
+            capture = self.captures.get(url)
+            if capture is None:
+                capture = Future()
+                self.captures[url] = capture
+                self.targets.put((url, item_type, capture))
+                if len(self.threads) < self.workers:
+                    thread = threading.Thread(target=self.run, args=(len(self.threads),), daemon=True)
+                    self.threads.append(thread)
+                    thread.start()
+            else:
+                metrics.count("external_duplicates")
+
+        placed = Future()
+        capture.add_done_callback(lambda f: self.place(f, folder, placed))
+        return placed
+
+    def place(self, capture, folder, placed):
+        try:
+            path = capture.result()
+            if self.archive is not None:
+                placed.set_result(self.archive.add_file(folder, os.path.basename(path), path))
+            else:
+                placed.set_result(place_copy(path, folder))
+        except Exception as e:
+            placed.set_exception(e)
+
+    def run(self, index):
+        staging_folder = os.path.join(self.staging_folder, "capture%d" % index)
+        try:
+            driver = self.new_driver(staging_folder, index)
+        except Exception as e:
+            driver, error = None, e
+        if driver is not None:
+            with self.lock:
+                self.drivers.append(driver)
+        captured = 0
+        while True:
+            url, item_type, capture = self.targets.get()
+            if url is None:
+                return
+            if driver is None:
+                capture.set_exception(error)
+                continue
+            # Each capture gets its own folder, so printed pages never collide
+            folder = os.path.join(staging_folder, "%d" % captured)
+            captured += 1
+            resolve, load = self.capturers[item_type]
+            try:
+                with metrics.span("external", item=url):
+                    target = resolve(driver, url) if resolve is not None else url
+                    with self.lock:
+                        same = self.resolved.setdefault(target, capture)
+                    if same is not capture:
+                        metrics.count("external_duplicates")
+                        same.add_done_callback(lambda f, capture=capture: chain(f, capture))
+                        continue
+                    load(driver, target)
+                    capture.set_result(self.save(driver, staging_folder, folder))
+            except Exception as e:
+                capture.set_exception(e)
+
+    def save(self, driver, staging_folder, folder):
+        os.makedirs(folder)
+        with metrics.span("print"):
+            if self.renderer is not None:
+                name, data = self.renderer.render(driver)
+                return write_pdf(data, os.path.join(folder, name))
+            driver.execute_script('window.print();')
+            if not wait_for_files(staging_folder, 1):
+                raise RuntimeError("Timed out printing " + driver.current_url)
+            name = finished_files(staging_folder)[0]
+            path = os.path.join(folder, name)
+            os.replace(os.path.join(staging_folder, name), path)
+            return path
+
+    def shutdown(self):
+        """ Stop the capture threads once the queue is drained and
+            quit their drivers.
+        """
+        for thread in self.threads:
+            self.targets.put((None, None, None))
+        for thread in self.threads:
+            thread.join()
+        for driver in self.drivers:
+            driver.quit()
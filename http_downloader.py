@@ -0,0 +1,215 @@
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pacing import paced_head
+from resumable_download import ResumableDownload, FileTooLarge
+from canvas_api import canvas_file_id
+from metrics import metrics
+
+DEFAULT_WORKERS = 8
+# Downloads queued per worker before submit blocks the caller
+QUEUE_PER_WORKER = 4
+
+def session_from_driver(driver, pool_size=DEFAULT_WORKERS):
+    """ Build a requests session that reuses the cookies and
+        user agent of a logged in selenium driver.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent;")
+    copy_driver_cookies(driver, session)
+    return session
+
+def copy_driver_cookies(driver, session):
+    """ Copy the cookies visible to the driver on its current
+        domain into the session.
+    """
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie["name"], cookie["value"], \
+                            domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+
+def response_version(response):
+    """ Size and version (ETag or Last-Modified) of a response.
+    """
+    size = response.headers.get("Content-Length")
+    size = int(size) if size is not None else None
+    version = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    return size, version
+
+def filename_from_response(response):
+    """ Get the file name Chrome would have saved a response as,
+        preferring the Content-Disposition header over the url.
+    """
+    disposition = response.headers.get("Content-Disposition", "")
+    match = re.search(r"filename\*\s*=\s*[^']*'[^']*'([^;]+)", disposition)
+    if match:
+        name = unquote(match.group(1).strip().strip('"'))
+    else:
+        match = re.search(r'filename\s*=\s*"?([^";]+)"?', disposition)
+        if match:
+            name = match.group(1).strip()
+        else:
+            name = unquote(os.path.basename(urlparse(response.url).path)) or "download"
+    return name.replace("/", "_").replace("\\", "_")
+
+class HttpDownloader:
+    """ Stream files into a blob store over a shared session,
+        running a bounded number of downloads at once.
+
+        Each Canvas file id is fetched at most once per run and then
+        linked into every folder it is submitted for. Files the
+        manifest already holds are checked with a HEAD request and
+        only fetched again if their size or version changed. Files
+        whose entry in listed, filled in by CanvasAPI, still matches
+        the manifest skip the HEAD request too.
+
+        With an ArchiveOutput, files are copied from the store into
+        their course's archive instead of linked into folders. Files
+        bigger than max_size are skipped, and their futures resolve
+        to None.
+    """
+    def __init__(self, session, store, manifest, workers=DEFAULT_WORKERS, archive=None, max_size=None):
+        self.session = session
+        self.store = store
+        self.manifest = manifest
+        self.listed = {}
+        self.archive = archive
+        self.max_size = max_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Segments of large files, kept apart so fetches never wait on their own pool
+        self.segment_executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers * QUEUE_PER_WORKER)
+        self.pending = set()
+        self.fetches = {}
+        self.lock = threading.Lock()
+        self.place_lock = threading.Lock()
+
+    def submit(self, url, folder, file_id=None):
+        """ Queue a download of url into folder. Returns a future
+            that resolves to the saved path. Blocks while the download
+            queue is full.
+        """
+        if file_id is None:
+            file_id = canvas_file_id(url)
+        with self.lock:
+            fetch = self.fetches.get(file_id)
+        if fetch is None:
+            self.slots.acquire()
+            with self.lock:
+                fetch = self.fetches.get(file_id)
+                if fetch is None:
+                    fetch = self.executor.submit(self.fetch, url, file_id, metrics.context())
+                    fetch.add_done_callback(lambda f: self.slots.release())
+                    self.fetches[file_id] = fetch
+                else:
+                    self.slots.release()
+
+        placed = Future()
+        fetch.add_done_callback(lambda f: self.place(f, folder, file_id, placed))
+        with self.lock:
+            self.pending.add(placed)
+        placed.add_done_callback(self.settled)
+        return placed
+
+    def fetch(self, url, file_id, context):
+        """ Make sure the store holds the current content of file_id
+            and return its digest and file name, or None if it is too
+            large. context labels the download's timing with the item
+            that first asked for it.
+        """
+        entry = self.manifest.get(file_id)
+        listed = self.listed.get(file_id)
+        if entry is not None and self.store.has(entry["sha256"]):
+            if self.manifest.is_listed(file_id, listed):
+                metrics.count("files_unchanged")
+                return entry["sha256"], entry["name"]
+            with metrics.span("head_check", **context), \
+                 paced_head(self.session, url, timeout=60) as response:
+                if response.ok and self.manifest.is_current(file_id, *response_version(response)):
+                    metrics.count("files_unchanged")
+                    if listed is not None:
+                        self.manifest.record(file_id, entry["size"], entry["version"], entry["sha256"], \
+                                             entry["name"], listed)
+                    return entry["sha256"], entry["name"]
+
+        with metrics.span("download", **context) as span:
+            download = ResumableDownload(self.session, url, self.store.part_path(file_id), \
+                                         filename_from_response, self.segment_executor, max_size=self.max_size)
+            try:
+                size, version, digest, name = download.run()
+            except FileTooLarge:
+                metrics.count("files_too_large")
+                return None
+            finally:
+                span["bytes"] = download.transferred
+                metrics.count("bytes_downloaded", download.transferred)
+        metrics.count("files_downloaded")
+
+        self.store.add(download.part_path, digest)
+        self.manifest.record(file_id, size, version, digest, name, listed)
+        return digest, name
+
+    def place(self, fetch, folder, file_id, placed):
+        """ Link a fetched file into folder, reusing the path it had
+            there before, and resolve placed with that path.
+        """
+        try:
+            if fetch.result() is None:
+                placed.set_result(None)
+                return
+            digest, name = fetch.result()
+            if self.archive is not None:
+                placed.set_result(self.archive.add_file(folder, name, self.store.blob_path(digest), digest))
+                return
+            with self.place_lock:
+                path = self.manifest.path_in(file_id, folder)
+                if path is None:
+                    path = self.reserve_path(folder, name)
+                self.store.link(digest, path)
+                self.manifest.add_path(file_id, path)
+            placed.set_result(path)
+        except Exception as e:
+            placed.set_exception(e)
+
+    def reserve_path(self, folder, name):
+        """ Claim a new file name in folder named like Chrome would,
+            adding " (n)" before the extension on collisions.
+        """
+        root, ext = os.path.splitext(name)
+        n = 0
+        with self.lock:
+            while True:
+                candidate = name if n == 0 else "%s (%d)%s" % (root, n, ext)
+                path = os.path.join(folder, candidate)
+                try:
+                    open(path, "xb").close()
+                    return path
+                except FileExistsError:
+                    n += 1
+
+    def wait(self):
+        """ Block until every queued download finishes, raising
+            the first failure.
+        """
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.result()
+
+    def settled(self, future):
+        if future.exception() is None:
+            with self.lock:
+                self.pending.discard(future)
+
+    def shutdown(self):
+        self.wait()
+        self.executor.shutdown()
+        self.segment_executor.shutdown()
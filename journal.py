@@ -0,0 +1,39 @@
+import os
+import json
+import threading
+
+class Journal:
+    """ Append-only JSON lines record of finished work, so an
+        interrupted run can resume where it stopped.
+
+        Each line marks one item of a course section as saved, or
+        the whole section when item is None. Lines are flushed and
+        synced as they are written; a torn last line is ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.finished = set()
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.finished.add((entry["course"], entry["section"], entry["item"]))
+
+    def done(self, course, section, item=None):
+        return (course, section, item) in self.finished
+
+    def record(self, course, section, item=None):
+        line = json.dumps({"course": course, "section": section, "item": item}) + "\n"
+        with self.lock:
+            if (course, section, item) in self.finished:
+                return
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.finished.add((course, section, item))
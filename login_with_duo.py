@@ -1,12 +1,15 @@
 import os  
 import sys
-import time
 from selenium import webdriver  
 from selenium.webdriver.common.keys import Keys  
 from selenium.webdriver.chrome.options import Options 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from urllib.parse import urlparse
+import requests
+from pacing import limiter
+from session_cache import SessionCache
 
 try:
     from duo_gen import generate_next_token
@@ -16,6 +19,12 @@ except ModuleNotFoundError:
     login_manually = True
     print("Manual Login")
 
+CANVAS_PROBE = "/api/v1/users/self"
+
+session_cache = SessionCache()
+# Session ids of drivers that have already logged in to the LMS
+lms_sessions = set()
+
 class AnyEC:
     """ Use with WebDriverWait to combine expected_conditions
         in an OR.
@@ -31,9 +40,46 @@ class AnyEC:
             except:
                 pass
         return False
+
+def site_root(url):
+    parsed = urlparse(url)
+    return "%s://%s" % (parsed.scheme, parsed.netloc)
+
+def add_cookies(driver, url, cookies):
+    """ Load cookies into driver for the site serving url.
+    """
+    # Cookies can only be added for the domain currently loaded
+    driver.get(site_root(url) + "/robots.txt")
+    for cookie in cookies:
+        cookie = {key: cookie[key] for key in ("name", "value", "domain", "path", "secure", "httpOnly", \
+                                               "sameSite", "expiry") \
+                  if key in cookie}
+        driver.add_cookie(cookie)
+
+def cookies_valid(url, cookies, probe_path):
+    """ Whether cookies still authenticate a request to probe_path
+        on the site serving url, without touching the browser.
+    """
+    session = requests.Session()
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"], \
+                            domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+    try:
+        response = session.get(site_root(url) + probe_path, allow_redirects=False, timeout=10)
+    except requests.RequestException:
+        return False
+    return response.status_code == 200
     
 def login_to_canvas(driver, page, wait_until):
     wait = WebDriverWait(driver, 10)
+    domain = urlparse(page).hostname
+    cookies = session_cache.cookies(domain)
+    if cookies is not None:
+        if cookies_valid(page, cookies, CANVAS_PROBE):
+            add_cookies(driver, page, cookies)
+        else:
+            # The session ended early, e.g. on logout; don't try it again next run
+            session_cache.forget(domain)
     driver.get(page)
     
     if driver.current_url == page:
@@ -68,11 +114,28 @@ def login_to_canvas(driver, page, wait_until):
     
     # Wait until logged in
     wait.until(wait_until)
+    session_cache.save(domain, driver.get_cookies())
+
+def lms_logged_in(driver, domain):
+    lms_sessions.add(driver.session_id)
+    session_cache.save(domain, driver.get_cookies())
 
 def login_to_lms(driver, page, wait_until):
     wait = WebDriverWait(driver, 10)
+
+    if driver.session_id in lms_sessions:
+        limiter.wait(page)
+        driver.get(page)
+        wait.until(wait_until)
+        return
+
+    domain = urlparse(page).hostname
+    cookies = session_cache.cookies(domain)
+    if cookies is not None:
+        add_cookies(driver, page, cookies)
+
+    limiter.wait(page)
     driver.get(page)
-    time.sleep(3)
     
     wait.until(EC.visibility_of_element_located((By.CLASS_NAME, "learning-header")))
     
@@ -81,12 +144,14 @@ def login_to_lms(driver, page, wait_until):
     if i == 0:
         result.click()
     else:
+        lms_logged_in(driver, domain)
         return 
     
     wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "button-saml-mit-kerberos"))).click()
     
     try:
         driver.find_element(by=By.CLASS_NAME, value="user-dropdown")
+        lms_logged_in(driver, domain)
         return
     except:
         pass
@@ -118,3 +183,4 @@ def login_to_lms(driver, page, wait_until):
     
     # Wait until logged in
     wait.until(wait_until)
+    lms_logged_in(driver, domain)
@@ -0,0 +1,93 @@
+import os
+import json
+import threading
+
+class Manifest:
+    """ Append-only JSON lines index of downloaded Canvas files,
+        keyed by file id. Each entry holds the size and version
+        (ETag or Last-Modified) Canvas reported, the sha256 of the
+        content in the blob store, and every path it is linked at.
+        Files found through the API also keep the [size, modified_at]
+        pair the file listing gave as listed.
+
+        Later lines override earlier ones, so an interrupted write
+        loses at most the last entry.
+    """
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "sha256" not in entry:
+                        # Written before files were kept in the blob store
+                        continue
+                    self.entries[entry["id"]] = entry
+
+    def get(self, file_id):
+        return self.entries.get(file_id)
+
+    def is_current(self, file_id, size, version):
+        """ Whether file_id was already saved with the given size
+            and version.
+        """
+        entry = self.entries.get(file_id)
+        if entry is None:
+            return False
+        if version is None and size is None:
+            return False
+        return entry["size"] == size and entry["version"] == version
+
+    def is_listed(self, file_id, listed):
+        """ Whether file_id was already saved when the file listing
+            gave the same [size, modified_at].
+        """
+        entry = self.entries.get(file_id)
+        return entry is not None and listed is not None and entry.get("listed") == listed
+
+    def path_in(self, file_id, folder):
+        """ Absolute path file_id is linked at inside folder, if any.
+        """
+        entry = self.entries.get(file_id)
+        if entry is None:
+            return None
+        for path in entry["paths"]:
+            path = os.path.join(self.root, path)
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(folder):
+                return path
+        return None
+
+    def record(self, file_id, size, version, digest, name, listed=None):
+        with self.lock:
+            previous = self.entries.get(file_id)
+            entry = {
+                "id": file_id,
+                "size": size,
+                "version": version,
+                "sha256": digest,
+                "name": name,
+                "paths": previous["paths"] if previous is not None else [],
+            }
+            if listed is not None:
+                entry["listed"] = listed
+            self.write(entry)
+
+    def add_path(self, file_id, path):
+        with self.lock:
+            entry = dict(self.entries[file_id])
+            path = os.path.relpath(path, self.root)
+            if path not in entry["paths"]:
+                entry["paths"] = entry["paths"] + [path]
+                self.write(entry)
+
+    def write(self, entry):
+        self.entries[entry["id"]] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
@@ -0,0 +1,135 @@
+import os
+import csv
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+PROGRESS_INTERVAL = 10
+SLOWEST_ITEMS = 20
+SPAN_FIELDS = ["phase", "course", "section", "item", "start", "seconds", "ok", "bytes"]
+
+class Metrics:
+    """ Timed spans and counters for one run.
+
+        Spans are labelled with the course, section and item they
+        belong to. Labels given to a span are inherited by spans
+        opened inside it on the same thread, so a page load deep in
+        an item handler is still attributed to its course.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.spans = []
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def context(self):
+        """ Labels of the spans open on this thread, to carry work
+            handed to another thread.
+        """
+        return dict(getattr(self.local, "context", {}))
+
+    @contextmanager
+    def span(self, phase, **labels):
+        """ Time the enclosed block as phase. Yields the span's record,
+            which the block may annotate, e.g. with bytes transferred.
+        """
+        outer = self.context()
+        context = dict(outer, **{label: value for label, value in labels.items() if value is not None})
+        record = dict(context, phase=phase, start=time.monotonic() - self.started, ok=False)
+        self.local.context = context
+        try:
+            yield record
+            record["ok"] = True
+        finally:
+            self.local.context = outer
+            record["seconds"] = time.monotonic() - self.started - record["start"]
+            with self.lock:
+                self.spans.append(record)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def value(self, name):
+        return self.counters[name]
+
+    def summary(self):
+        """ Totals per phase and per course, the slowest items and
+            every counter.
+        """
+        with self.lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+
+        phases = defaultdict(lambda: {"count": 0, "seconds": 0, "max_seconds": 0, "failed": 0})
+        courses = defaultdict(lambda: defaultdict(float))
+        for span in spans:
+            phase = phases[span["phase"]]
+            phase["count"] += 1
+            phase["seconds"] += span["seconds"]
+            phase["max_seconds"] = max(phase["max_seconds"], span["seconds"])
+            phase["failed"] += not span["ok"]
+            if "course" in span:
+                courses[span["course"]][span["phase"] + "_seconds"] += span["seconds"]
+                courses[span["course"]]["bytes"] += span.get("bytes", 0)
+
+        items = sorted((span for span in spans if span["phase"] == "item"), \
+                       key=lambda span: span["seconds"], reverse=True)
+        return {
+            "phases": dict(phases),
+            # Slowest courses first
+            "courses": dict(sorted(courses.items(), key=lambda c: c[1].get("item_seconds", 0), reverse=True)),
+            "slowest_items": [{field: span.get(field) for field in ("course", "section", "item", "seconds")} \
+                              for span in items[:SLOWEST_ITEMS]],
+            "counters": counters,
+        }
+
+    def write_report(self, path, **extra):
+        """ Write extra and the summary to path as JSON, and every span
+            to a CSV file next to it.
+        """
+        with open(path, "w") as f:
+            json.dump(dict(extra, **self.summary()), f, indent=2)
+        with self.lock:
+            spans = list(self.spans)
+        with open(os.path.splitext(path)[0] + "_spans.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, SPAN_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(spans)
+
+class Progress:
+    """ Print items done out of items discovered, throughput and an
+        ETA every interval seconds until stopped. Discovery runs
+        ahead of saving, so the ETA only covers work found so far.
+    """
+    def __init__(self, metrics, interval=PROGRESS_INTERVAL):
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            print(self.line())
+
+    def line(self):
+        elapsed = time.monotonic() - self.metrics.started
+        done = self.metrics.value("items_done")
+        discovered = self.metrics.value("items_discovered")
+        rate = done / elapsed if elapsed else 0
+        eta = "%ds" % ((discovered - done) / rate) if rate else "unknown"
+        return "[%ds] %d/%d items, %.2f items/s, %.1f MB downloaded, ETA %s" % \
+               (elapsed, done, discovered, rate, self.metrics.value("bytes_downloaded") / 2**20, eta)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+metrics = Metrics()
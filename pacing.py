@@ -0,0 +1,143 @@
+import time
+import threading
+from urllib.parse import urlparse
+
+from metrics import metrics
+
+# Requests per second allowed to each host, and how many may burst at once
+HOST_RATES = {
+    "canvas.mit.edu": (5, 5),
+    "lms.mitx.mit.edu": (2, 2),
+}
+DEFAULT_RATE = (2, 2)
+MIN_RATE = 0.2
+MAX_BACKOFF = 60
+MAX_ATTEMPTS = 5
+# Refusals in a row, with no success between, taken as the host pushing back
+REFUSAL_STREAK = 5
+
+sleep_lock = threading.Lock()
+time_slept = 0
+
+def sleep(seconds):
+    """ time.sleep that adds to the total reported by slept().
+    """
+    global time_slept
+    time.sleep(seconds)
+    with sleep_lock:
+        time_slept += seconds
+
+def slept():
+    """ Seconds spent pacing, backing off and polling so far,
+        summed across threads.
+    """
+    return time_slept
+
+class TokenBucket:
+    """ Token bucket whose rate is cut in half whenever the host
+        pushes back and creeps back up as requests succeed.
+    """
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.backoff = 1
+        self.refusals = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative, reserving a later slot for this caller
+            self.tokens -= 1
+            delay = max(-self.tokens / self.rate, self.blocked_until - now)
+        if delay > 0:
+            sleep(delay)
+
+    def throttled(self, retry_after=None):
+        with self.lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            pause = retry_after if retry_after is not None else self.backoff
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+            self.refusals = 0
+
+    def refused(self):
+        """ Note a request the host turned down without saying why,
+            returning how many were turned down in a row.
+        """
+        with self.lock:
+            self.refusals += 1
+            return self.refusals
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.1 * self.max_rate)
+            self.backoff = 1
+            self.refusals = 0
+
+class RateLimiter:
+    """ Pace requests with one token bucket per host.
+    """
+    def __init__(self, host_rates=HOST_RATES, default_rate=DEFAULT_RATE):
+        self.host_rates = host_rates
+        self.default_rate = default_rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(*self.host_rates.get(host, self.default_rate))
+            return self.buckets[host]
+
+    def wait(self, url):
+        self.bucket(url).acquire()
+
+    def throttled(self, url, retry_after=None):
+        self.bucket(url).throttled(retry_after)
+
+    def refused(self, url):
+        return self.bucket(url).refused()
+
+    def succeeded(self, url):
+        self.bucket(url).succeeded()
+
+limiter = RateLimiter()
+
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return min(MAX_BACKOFF, float(value))
+    except (TypeError, ValueError):
+        return None
+
+def paced_request(session, method, url, **kwargs):
+    """ session.request paced by the shared limiter. Responses with
+        status 429 or 5xx slow the host down and are retried up to
+        MAX_ATTEMPTS times; the last response is returned as is.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.wait(url)
+        response = session.request(method, url, **kwargs)
+        if response.status_code != 429 and response.status_code < 500:
+            limiter.succeeded(url)
+            return response
+        metrics.count("http_throttled")
+        limiter.throttled(url, retry_after(response))
+        if attempt < MAX_ATTEMPTS - 1:
+            response.close()
+    return response
+
+def paced_get(session, url, **kwargs):
+    return paced_request(session, "GET", url, **kwargs)
+
+def paced_head(session, url, **kwargs):
+    kwargs.setdefault("allow_redirects", True)
+    return paced_request(session, "HEAD", url, **kwargs)
@@ -0,0 +1,60 @@
+import os
+import re
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+DEFAULT_WORKERS = 2
+MAX_TITLE_LENGTH = 100
+
+def item_id_from_url(url):
+    """ Last path segment of a Canvas item url, e.g. the page slug
+        or the assignment, quiz or discussion topic id.
+    """
+    path = urlparse(url).path.rstrip("/")
+    return unquote(path[path.rindex("/") + 1:]) if "/" in path else path
+
+def pdf_filename(url, title):
+    name = "%s %s" % (item_id_from_url(url), title.strip())
+    name = re.sub(r'[\\/:*?"<>|\s]+', "_", name).strip("_")[:MAX_TITLE_LENGTH]
+    return name + ".pdf"
+
+def write_pdf(data, path):
+    with open(path, "wb") as f:
+        f.write(base64.b64decode(data))
+    return path
+
+class PdfRenderer:
+    """ Save the page a driver is showing as a PDF through the
+        DevTools Page.printToPDF command. Needs a headless Chrome.
+
+        The driver is only busy while Chrome renders; decoding and
+        writing the PDF happen in a separate worker pool. With an
+        ArchiveOutput, PDFs are written into the course's archive.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, archive=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.archive = archive
+
+    def submit(self, driver, folder):
+        """ Render the current page of driver into folder, named by
+            its Canvas item id and title. Returns a future that
+            resolves to the saved path.
+        """
+        name, data = self.render(driver)
+        return self.executor.submit(self.write, data, folder, name)
+
+    def render(self, driver):
+        """ File name and base64 encoded PDF of the current page.
+        """
+        name = pdf_filename(driver.current_url, driver.title)
+        result = driver.execute_cdp_cmd("Page.printToPDF", {"printBackground": True})
+        return name, result["data"]
+
+    def write(self, data, folder, name):
+        if self.archive is not None:
+            return self.archive.add_bytes(folder, name, base64.b64decode(data))
+        return write_pdf(data, os.path.join(folder, name))
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import concurrent.futures
+
+import requests
+
+import pacing
+from pacing import paced_get
+from metrics import metrics
+
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 5
+RETRY_BACKOFF = 1
+# Files at least this big are fetched as parallel ranged segments
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_SEGMENTS = 4
+
+class FileTooLarge(Exception):
+    pass
+
+class FileChanged(Exception):
+    pass
+
+# Errors a download can resume after, as opposed to refused requests
+RESUMABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+def total_size(response):
+    """ Full size of the file a response carries part or all of.
+    """
+    match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+    if match:
+        return int(match.group(1))
+    size = response.headers.get("Content-Length")
+    return int(size) if size is not None else None
+
+def etag_md5(version):
+    """ MD5 of the content when version is an ETag that holds one,
+        as S3 gives for files uploaded in a single part.
+    """
+    if version is None:
+        return None
+    version = version.strip()
+    if version.startswith("W/"):
+        return None
+    version = version.strip('"').lower()
+    return version if re.fullmatch(r"[0-9a-f]{32}", version) else None
+
+def file_hashes(path, md5=False):
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5() if md5 else None
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            if md5 is not None:
+                md5.update(chunk)
+    return sha256.hexdigest(), md5.hexdigest() if md5 is not None else None
+
+class ResumableDownload:
+    """ Download url into part_path, surviving dropped connections.
+        name_from gives the file name to save a response under.
+        Files bigger than max_size raise FileTooLarge before their
+        content is read.
+
+        Progress is kept in part_path and a small JSON file next to
+        it. After a failure, in this run or an earlier one, the
+        download continues with a Range request as long as the file
+        has not changed (If-Range); if it has, the download starts
+        over from the first byte. Files of at least
+        SEGMENT_THRESHOLD bytes are split into ranged segments
+        fetched in parallel on segment_executor.
+
+        The finished file is checked against the size the server
+        reported, and against the MD5 in its ETag when there is one.
+    """
+    def __init__(self, session, url, part_path, name_from, segment_executor=None, segments=DEFAULT_SEGMENTS, \
+                 max_size=None):
+        self.session = session
+        self.url = url
+        self.name_from = name_from
+        self.max_size = max_size
+        self.part_path = part_path
+        self.state_path = part_path + ".json"
+        self.segment_executor = segment_executor
+        self.segments = segments
+        self.transferred = 0
+        self.lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(self.state_path) and os.path.exists(part_path):
+            try:
+                with open(self.state_path) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                self.state = {}
+
+    def save_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def run(self):
+        """ Download the whole file and return its size, version
+            (ETag or Last-Modified), sha256 and name.
+        """
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            try:
+                if self.state.get("segments") is not None:
+                    self.fetch_segments()
+                else:
+                    self.fetch_stream()
+                break
+            except FileChanged:
+                # The parts fetched so far belong to an older version
+                if attempt == DOWNLOAD_ATTEMPTS - 1:
+                    raise
+                metrics.count("download_restarts")
+                self.restart()
+            except RESUMABLE_ERRORS:
+                if attempt == DOWNLOAD_ATTEMPTS - 1:
+                    raise
+                metrics.count("download_resumes")
+                pacing.sleep(RETRY_BACKOFF * 2 ** attempt)
+        size = self.state.get("size")
+        version, name = self.state.get("version"), self.state.get("name")
+        return size, version, self.verify(), name
+
+    def fetch_stream(self):
+        """ Fetch the rest of the file in one request, or switch to
+            segments if the file turns out to be big enough.
+        """
+        offset = os.path.getsize(self.part_path) if self.state.get("version") else 0
+        headers = {}
+        if offset:
+            headers = {"Range": "bytes=%d-" % offset, "If-Range": self.state["version"]}
+
+        with paced_get(self.session, self.url, stream=True, timeout=60, headers=headers) as response:
+            if response.status_code == 416 and offset:
+                # Nothing left after offset: the part is complete, or not this file
+                match = re.match(r"bytes \*/(\d+)", response.headers.get("Content-Range", ""))
+                size = int(match.group(1)) if match else self.state.get("size")
+                if size in (None, offset) and self.state.get("size") in (None, offset):
+                    return
+                raise FileChanged("%s is %s bytes, not %d" % (self.url, size, offset))
+            response.raise_for_status()
+            if response.status_code == 206 and \
+               not response.headers.get("Content-Range", "").startswith("bytes %d-" % offset):
+                raise FileChanged("Server sent the wrong range of " + self.url)
+            if response.status_code != 206:
+                # A fresh start, or the file changed since the part was written
+                offset = 0
+                self.state = {
+                    "version": response.headers.get("ETag") or response.headers.get("Last-Modified"),
+                    "size": total_size(response),
+                    "name": self.name_from(response),
+                    "ranges": response.headers.get("Accept-Ranges") == "bytes",
+                }
+                if self.max_size is not None and (self.state["size"] or 0) > self.max_size:
+                    raise FileTooLarge("%s is %d bytes" % (self.url, self.state["size"]))
+                if self.state["ranges"] and self.segment_executor is not None and \
+                   (self.state["size"] or 0) >= SEGMENT_THRESHOLD:
+                    metrics.count("segmented_downloads")
+                    self.state["segments"] = []
+                    open(self.part_path, "wb").close()
+                    self.save_state()
+                    return self.fetch_segments()
+                self.save_state()
+
+            with open(self.part_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    self.transferred += len(chunk)
+
+        if self.state["size"] is not None and os.path.getsize(self.part_path) < self.state["size"]:
+            raise requests.exceptions.ChunkedEncodingError("Connection closed before the end of the file")
+
+    def segment_ranges(self):
+        size = self.state["size"]
+        segment_size = max(MIN_SEGMENT_SIZE, -(-size // self.segments))
+        return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+    def fetch_segments(self):
+        """ Fetch every segment not yet finished in parallel. Each
+            segment retries on its own; unfinished segments of an
+            earlier run start over.
+        """
+        with open(self.part_path, "r+b") as f:
+            f.truncate(self.state["size"])
+        done = set(self.state["segments"])
+        futures = [self.segment_executor.submit(self.fetch_segment, start, end) \
+                   for start, end in self.segment_ranges() if start not in done]
+        # Let every segment stop writing before a failure restarts the file
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def fetch_segment(self, start, end):
+        position = start
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            headers = {"Range": "bytes=%d-%d" % (position, end), "If-Range": self.state["version"]}
+            try:
+                with paced_get(self.session, self.url, stream=True, timeout=60, headers=headers) as response, \
+                     open(self.part_path, "r+b") as f:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise FileChanged("File changed while downloading: " + self.url)
+                    f.seek(position)
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk[:end + 1 - position])
+                        position += len(chunk)
+                        with self.lock:
+                            self.transferred += len(chunk)
+                if position <= end:
+                    raise requests.exceptions.ChunkedEncodingError("Segment ended early")
+                break
+            except RESUMABLE_ERRORS:
+                if attempt == DOWNLOAD_ATTEMPTS - 1:
+                    raise
+                metrics.count("download_resumes")
+                pacing.sleep(RETRY_BACKOFF * 2 ** attempt)
+        with self.lock:
+            self.state["segments"].append(start)
+            self.save_state()
+
+    def verify(self):
+        """ Check the finished part file and return its sha256. A part
+            that fails is removed so the next attempt starts over.
+        """
+        expected_md5 = etag_md5(self.state.get("version"))
+        size = os.path.getsize(self.part_path)
+        digest, md5 = file_hashes(self.part_path, expected_md5 is not None)
+        if self.state.get("size") is not None and size != self.state["size"]:
+            problem = "expected %d bytes, got %d" % (self.state["size"], size)
+        elif expected_md5 is not None and md5 != expected_md5:
+            problem = "MD5 does not match ETag"
+        else:
+            os.remove(self.state_path)
+            return digest
+        self.discard()
+        raise IOError("Download of %s failed verification: %s" % (self.url, problem))
+
+    def restart(self):
+        """ Drop the progress made so far and start again from the
+            first byte.
+        """
+        self.discard()
+        self.state = {}
+
+    def discard(self):
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import threading
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    use_encryption = True
+except ModuleNotFoundError:
+    use_encryption = False
+    print("Session cache disabled (pip install cryptography to enable it)")
+
+SESSION_CACHE_FILE = os.path.abspath('.session_cache')
+SESSION_KEY_FILE = os.path.expanduser('~/.canvas_materials_key')
+SESSION_KEY_ENV = "CANVAS_SESSION_KEY"
+
+def load_key(key_file):
+    """ Encryption key from the environment, or from key_file,
+        which is created readable only by the user if missing.
+    """
+    key = os.environ.get(SESSION_KEY_ENV)
+    if key:
+        return key.encode()
+    if not os.path.exists(key_file):
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(Fernet.generate_key())
+    with open(key_file, "rb") as f:
+        return f.read().strip()
+
+class SessionCache:
+    """ Encrypted on-disk store of login cookies per domain, so
+        later runs can skip SSO and Duo while the session lasts.
+        Does nothing when cryptography is not installed.
+    """
+    def __init__(self, path=SESSION_CACHE_FILE, key_file=SESSION_KEY_FILE):
+        self.path = path
+        self.enabled = use_encryption
+        self.domains = {}
+        self.lock = threading.Lock()
+
+        if self.enabled:
+            self.fernet = Fernet(load_key(key_file))
+            if os.path.exists(path):
+                try:
+                    with open(path, "rb") as f:
+                        self.domains = json.loads(self.fernet.decrypt(f.read()))
+                except (InvalidToken, ValueError):
+                    self.domains = {}
+
+    def cookies(self, domain):
+        """ Unexpired cookies saved for domain, or None.
+        """
+        now = time.time()
+        cookies = [cookie for cookie in self.domains.get(domain, []) \
+                   if cookie.get("expiry") is None or cookie["expiry"] > now]
+        return cookies or None
+
+    def save(self, domain, cookies):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.domains[domain] = cookies
+            data = self.fernet.encrypt(json.dumps(self.domains).encode())
+            temp_path = self.path + ".tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+
+    def forget(self, domain):
+        if domain in self.domains:
+            self.save(domain, [])